@@ -0,0 +1,152 @@
+"""Время и память одной отрисовки графиков прогресса: прежний draw_stat на pandas/seaborn
+против нынешнего на NumPy и объектном API matplotlib из ``charts.py``.
+
+Каждый вариант запускается в отдельном процессе, как в пуле отрисовки: печатаются время первой
+отрисовки (с импортом библиотек), медиана последующих, пик памяти Python на отрисовку (tracemalloc)
+и прирост RSS процесса с начала первой отрисовки. Для прежнего варианта нужны pandas и seaborn.
+
+Запуск из корня репозитория: ``python -m benchmarks.chart_render``
+"""
+import io
+import time
+import random
+import argparse
+import datetime
+import resource
+import statistics
+import tracemalloc
+import multiprocessing
+
+KEYS = ("water", "calories_in", "calories_out")
+
+
+def legacy_draw_stat(today, history, last_date, cal_food_norm, water_norm):
+    # draw_stat до перехода на NumPy: DataFrame на каждый вызов, seaborn и pyplot
+    import matplotlib
+    matplotlib.use("Agg")
+    import pandas as pd
+    import seaborn as sns
+    import matplotlib.pyplot as plt
+
+    def to_png(fig):
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format="png", bbox_inches="tight")
+        return buffer.getvalue()
+
+    def finish(fig, ax1, ax2, title):
+        ax1.set_ylabel("ккал", color="maroon")
+        ax2.set_ylabel("мл", color="navy")
+        ax1.tick_params(axis='y', labelcolor="maroon")
+        ax2.tick_params(axis='y', labelcolor="navy")
+        lines_labels = [ax.get_legend_handles_labels() for ax in fig.axes]
+        lines, labels = [sum(lol, []) for lol in zip(*lines_labels)]
+        ax2.set_title(title)
+        ax2.legend(lines, labels)
+
+    last_df_cs = pd.DataFrame.from_dict(today).cumsum()
+    if last_df_cs.shape[0] == 0:
+        return []
+
+    sum_df = pd.DataFrame.from_dict(history).T.rename_axis("date").reset_index()
+
+    fig, ax1 = plt.subplots(figsize=(8, 4))
+    try:
+        sns.barplot(last_df_cs["calories_in"], ax=ax1, label="Потреблено ккал", color="crimson")
+        sns.barplot(last_df_cs["calories_out"], ax=ax1, label="Сожжено ккал", color="maroon")
+        ax1.axhline(cal_food_norm, color="red", label="Норма потребления в день", linestyle="--")
+        ax1.set_xlabel("Номер записи в истории")
+        ax2 = ax1.twinx()
+        sns.lineplot(last_df_cs["water"], ax=ax2, linewidth=3, label="Потреблено воды", color="royalblue")
+        ax2.axhline(water_norm, color="royalblue", label="Норма воды в день", linestyle="--", zorder=1)
+        finish(fig, ax1, ax2, f"Накопительная динамика прогресса за сегодня ({last_date})")
+        images = [to_png(fig)]
+    finally:
+        plt.close(fig)
+
+    if len(sum_df["date"]) > 1:
+        fig, ax1 = plt.subplots(figsize=(8, 4))
+        try:
+            sns.barplot(sum_df, x="date", y="calories_in", ax=ax1, label="Потреблено ккал", color="crimson")
+            sns.barplot(sum_df, x="date", y="calories_out", ax=ax1, label="Сожжено ккал", color="maroon")
+            ax1.axhline(cal_food_norm, color="red", label="Норма потребления в день", linestyle="--")
+            ax1.set_xlabel("Дата")
+            ax1.tick_params(axis='x', labelrotation=15 * (len(sum_df["date"]) // 6))
+            ax2 = ax1.twinx()
+            sns.lineplot(sum_df, x="date", y="water", ax=ax2, linewidth=3, label="Потреблено воды", color="royalblue")
+            ax2.axhline(water_norm, color="royalblue", label="Норма воды в день", linestyle="--", zorder=1)
+            finish(fig, ax1, ax2, "Суммарная динамика прогресса за все время")
+            images.append(to_png(fig))
+        finally:
+            plt.close(fig)
+
+    return images
+
+
+def make_input(records, days, seed=0):
+    rng = random.Random(seed)
+    today = {key: [] for key in KEYS}
+    for _ in range(records):
+        kind = rng.choice(KEYS)
+        for key in KEYS:
+            today[key].append(rng.randint(100, 600) if key == kind else 0)
+
+    start = datetime.date(2026, 1, 1)
+    history = {
+        (start + datetime.timedelta(days=i)).isoformat(): {
+            "water": rng.randint(500, 2500), "calories_in": rng.randint(800, 2600), "calories_out": rng.randint(0, 600),
+        }
+        for i in range(days)
+    }
+    return today, history, max(history)
+
+
+def run(variant, records, days, repeat, results):
+    if variant == "legacy":
+        draw = legacy_draw_stat
+    else:
+        from charts import draw_stat as draw
+    args = (*make_input(records, days), 2200, 2400)
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    start = time.perf_counter()
+    draw(*args)
+    first = time.perf_counter() - start
+
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        draw(*args)
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    draw(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - base_rss
+    results.put((variant, first, statistics.median(latencies), peak, rss))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=10, help="записей за последний день")
+    parser.add_argument("--days", type=int, default=30, help="дней в истории")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    for variant in ("legacy", "lean"):
+        process = context.Process(target=run, args=(variant, args.records, args.days, args.repeat, results))
+        process.start()
+        process.join()
+        if process.exitcode:
+            print(f"{variant}: процесс завершился с кодом {process.exitcode}")
+            continue
+        variant, first, median, peak, rss = results.get()
+        print(f"{variant:<7} первая отрисовка {first * 1000:7.0f} мс, медиана {median * 1000:6.1f} мс, "
+              f"пик памяти на отрисовку {peak / 1024:7.0f} КБ, прирост RSS {rss / 1024:5.0f} МБ")
+
+
+if __name__ == "__main__":
+    main()
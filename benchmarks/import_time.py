@@ -0,0 +1,65 @@
+"""Время холодного импорта бота: сколько проходит от запуска ``python bot.py`` до начала polling.
+
+Каждый замер -- отдельный процесс ``python -X importtime -c "import bot"``. Печатается медиана
+полного времени импорта и вклад модулей, которые ``bot.py`` импортирует напрямую.
+
+Запуск из корня репозитория: ``python -m benchmarks.import_time``
+"""
+import os
+import re
+import sys
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def measure(module):
+    env = dict(os.environ)
+    # Токен нужен только для создания объекта Bot, сеть при импорте не используется
+    env.setdefault("BOT_TOKEN", "123:benchmark")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    total = 0
+    direct = {}
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match is None:
+            continue
+        cumulative, indent, name = int(match.group(2)), len(match.group(3)), match.group(4)
+        if name == module and indent == 0:
+            total = cumulative
+        elif indent == 2:
+            direct[name] = cumulative
+    return total, direct
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="bot")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    totals = []
+    direct = defaultdict(list)
+    for _ in range(args.repeat):
+        total, modules = measure(args.module)
+        totals.append(total)
+        for name, cumulative in modules.items():
+            direct[name].append(cumulative)
+
+    print(f"import {args.module}: медиана {statistics.median(totals) / 1000:.0f} мс, "
+          f"мин {min(totals) / 1000:.0f} мс, макс {max(totals) / 1000:.0f} мс ({args.repeat} запусков)")
+    print("Прямые импорты (медиана, мс):")
+    ranked = sorted(direct.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for name, values in ranked[:args.top]:
+        print(f"  {name:<30} {statistics.median(values) / 1000:8.1f}")
+
+
+if __name__ == "__main__":
+    main()
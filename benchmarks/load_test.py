@@ -0,0 +1,271 @@
+"""Нагрузочный тест бота без сети: синтетические обновления подаются в ``dp.feed_update``.
+
+Telegram заменен фейковой сессией aiogram, GigaChat -- моделью из ``fake_gigachat.py``
+с заданной задержкой, OpenWeatherMap -- заглушкой запроса с задержкой. Кэши и хранилище
+работают как в боте, но во временном каталоге. Каждый пользователь проходит сценарий
+последовательно (как приходят его сообщения из Telegram), пользователи -- параллельно.
+
+Сценарии:
+
+* ``profile`` -- настройка профиля с автоматическим расчетом нормы воды (погода) и калорий
+* ``logging`` -- профиль, затем вода, еда (один продукт и прием пищи целиком) и тренировки
+* ``progress`` -- профиль, несколько записей и повторные /check_progress (графики и их кэш)
+* ``mixed`` -- все вместе
+
+Печатаются p50/p99 времени обработки по командам, пропускная способность, число обращений
+к заглушкам и прирост RSS процесса. Лимиты отправки в Telegram (``OutboundLimiter``) по умолчанию
+не действуют, иначе время команд почти целиком состояло бы из ожидания очереди отправки в чат;
+с ``--outbound-limit`` они включаются, и ожидание отправки печатается отдельно от времени обработки.
+
+Запуск из корня репозитория: ``python -m benchmarks.load_test --users 2000 --scenario mixed``
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import datetime
+import resource
+import tempfile
+import itertools
+import contextvars
+from collections import Counter, defaultdict
+
+from benchmarks.name_index import FOODS
+
+WORKOUTS = ["бег", "плавание", "велосипед", "приседания", "отжимания", "йога", "жим лежа", "ходьба", "теннис", "бокс"]
+CITIES = ["Москва", "Санкт-Петербург", "Казань", "Новосибирск", "Екатеринбург", "Сочи", "Самара", "Омск"]
+ADJECTIVES = ["домашний", "жареный", "вареный", "запеченный", "сырой", "диетический"]
+
+
+def configure(args, directory):
+    # Переменные окружения читаются модулями бота при импорте
+    os.environ.update({
+        "BOT_TOKEN": "123456:load-test",
+        "GIGACHAT_FAKE": "1",
+        "GIGACHAT_FAKE_LATENCY": str(args.gigachat_latency),
+        "GIGACHAT_MAX_CONCURRENCY": str(args.gigachat_concurrency),
+        "GIGACHAT_MAX_PENDING": str(args.users * 10),
+        "STORAGE_URL": "memory" if args.storage == "memory" else f"sqlite:///{directory}/bot.sqlite3",
+        "KNOWLEDGE_DB_PATH": f"{directory}/knowledge.sqlite3",
+        "LOG_FILE": f"{directory}/logs.log",
+        "LOG_LEVEL": args.log_level,
+        "THROTTLE_LIMITS": "default=1000000",
+        "PREWARM": "0",
+        "CHART_WORKERS": str(args.chart_workers),
+        "OUTBOUND_RATE": str(args.outbound_rate),
+        "OUTBOUND_CHAT_RATE": str(args.outbound_chat_rate),
+        "OUTBOUND_CHAT_BURST": str(args.outbound_chat_burst),
+    })
+
+
+def profile_script(rng):
+    return [
+        ("message", "/set_profile"),
+        ("callback", rng.choice(["мужской", "женский"])),
+        ("message", str(rng.randint(50, 110))),
+        ("message", str(rng.randint(150, 200))),
+        ("message", str(rng.randint(18, 70))),
+        ("message", rng.choice(CITIES)),
+        ("message", str(rng.choice([0, 15, 30, 60, 90]))),
+        ("message", "-"),
+        ("message", "-"),
+    ]
+
+
+def food(rng):
+    # Частые продукты из таблицы и кэша вперемешку с редкими, которых нет нигде
+    name = rng.choice(FOODS)
+    return f"{name} {rng.choice(ADJECTIVES)}{rng.randint(1, 50)}" if rng.random() < 0.2 else name
+
+
+def logging_script(rng, steps):
+    script = []
+    for _ in range(steps):
+        action = rng.random()
+        if action < 0.35:
+            script.append(("message", f"/log_water {rng.choice([150, 200, 250, 330, 500])}"))
+        elif action < 0.55:
+            script.append(("message", f"/log_food {food(rng)}"))
+            script.append(("message", str(rng.randint(30, 300))))
+        elif action < 0.8:
+            meal = ", ".join(f"{food(rng)} {rng.randint(20, 250)}" for _ in range(rng.randint(2, 4)))
+            script.append(("message", f"/log_food {meal}"))
+        else:
+            script.append(("message", f"/log_workout {rng.choice(WORKOUTS)} {rng.randint(10, 90)}"))
+    return script
+
+
+def build_script(scenario, rng, steps):
+    if scenario == "profile":
+        return profile_script(rng)
+    if scenario == "logging":
+        return profile_script(rng) + logging_script(rng, steps)
+    if scenario == "progress":
+        return profile_script(rng) + logging_script(rng, 3) + [("message", "/check_progress")] * 3
+    return profile_script(rng) + logging_script(rng, steps) + [("message", "/check_progress")] + logging_script(rng, 2) + [("message", "/check_progress")]
+
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))] if values else 0.0
+
+
+async def run(args):
+    from aiogram import types, methods
+    from aiogram.client.session.base import BaseSession
+
+    import bot
+
+    api_calls = Counter()
+
+    class FakeSession(BaseSession):
+        # Bot API, который сразу отвечает успехом на любой метод
+        async def make_request(self, bot, method, timeout=None):
+            api_calls[type(method).__name__] += 1
+            if isinstance(method, methods.SendMediaGroup):
+                return [self._message(method.chat_id)]
+            if type(method).__name__.startswith("Send"):
+                return self._message(method.chat_id)
+            return True
+
+        @staticmethod
+        def _message(chat_id):
+            return types.Message(message_id=1, date=datetime.datetime.now(), chat=types.Chat(id=chat_id, type="private"))
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def close(self):
+            pass
+
+    weather_calls = Counter()
+
+    async def fake_weather_request(url, payload):
+        weather_calls[url] += 1
+        await asyncio.sleep(args.weather_latency)
+        if "geo" in url:
+            return [{"lat": 55.75, "lon": 37.62}]
+        return {"main": {"temp": 15 + len(payload) % 15}}
+
+    # Время, которое обновление провело в ожидании отправки (у каждого пользователя своя задача и свой контекст)
+    send_wait = contextvars.ContextVar("send_wait")
+
+    async def measure_send(make_request, bot, method):
+        # Внешний middleware: фейковый Bot API отвечает сразу, поэтому все время запроса -- ожидание лимитов
+        start = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            # Запросы вне обработки обновлений (при запуске бота) не учитываются
+            wait = send_wait.get(None)
+            if wait is not None:
+                wait[0] += time.perf_counter() - start
+
+    bot.bot.session = FakeSession()
+    bot.bot.session.middleware(measure_send)
+    if args.outbound_limit:
+        # Лимиты отправки в Telegram подключены middleware к сессии бота
+        bot.bot.session.middleware(bot.outbound)
+    bot.weather._request = fake_weather_request
+
+    update_ids = itertools.count(1)
+    latencies = defaultdict(list)
+    waits = defaultdict(list)
+    errors = Counter()
+
+    def make_update(user_id, kind, text):
+        update_id = next(update_ids)
+        now = datetime.datetime.now()
+        user = types.User(id=user_id, is_bot=False, first_name=f"user{user_id}")
+        chat = types.Chat(id=user_id, type="private")
+        if kind == "callback":
+            message = types.Message(message_id=update_id, date=now, chat=chat, from_user=user, text="")
+            return types.Update(update_id=update_id, callback_query=types.CallbackQuery(
+                id=str(update_id), chat_instance=str(user_id), from_user=user, data=text, message=message,
+            ))
+        return types.Update(update_id=update_id, message=types.Message(
+            message_id=update_id, date=now, chat=chat, from_user=user, text=text,
+        ))
+
+    async def simulate(user_id, script, semaphore):
+        async with semaphore:
+            for kind, text in script:
+                label = text.split()[0] if text.startswith("/") else kind
+                update = make_update(user_id, kind, text)
+                wait = [0.0]
+                send_wait.set(wait)
+                start = time.perf_counter()
+                try:
+                    await bot.dp.feed_update(bot.bot, update)
+                except Exception:
+                    errors[label] += 1
+                # Время обработки -- без ожидания лимитов отправки, оно учитывается отдельно
+                latencies[label].append(time.perf_counter() - start - wait[0])
+                waits[label].append(wait[0])
+
+    rng = random.Random(args.seed)
+    scripts = [(100000 + user, build_script(args.scenario, rng, args.steps)) for user in range(args.users)]
+    total_updates = sum(len(script) for _, script in scripts)
+
+    await bot.dp.emit_startup(bot=bot.bot, dispatcher=bot.dp)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    semaphore = asyncio.Semaphore(args.concurrency)
+    start = time.perf_counter()
+    await asyncio.gather(*(simulate(user_id, script, semaphore) for user_id, script in scripts))
+    elapsed = time.perf_counter() - start
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    gigachat_calls = bot.gigachat_pool.model.calls
+    await bot.dp.emit_shutdown(bot=bot.bot, dispatcher=bot.dp)
+
+    print(f"Сценарий {args.scenario}: {args.users} пользователей, {total_updates} обновлений за {elapsed:.2f} с "
+          f"({total_updates / elapsed:.0f} обновлений/с), параллельно {args.concurrency} пользователей")
+    print("Время обработки без ожидания лимитов отправки в Telegram; ожидание отправки -- в последних столбцах")
+    print(f"{'команда':<16}{'число':>8}{'p50, мс':>10}{'p99, мс':>10}{'макс, мс':>10}{'ошибок':>8}"
+          f"{'отпр. p50':>11}{'отпр. p99':>11}")
+
+    def row(label, values, label_waits, label_errors):
+        values.sort()
+        label_waits.sort()
+        print(f"{label:<16}{len(values):>8}{percentile(values, 0.5) * 1000:>10.1f}"
+              f"{percentile(values, 0.99) * 1000:>10.1f}{values[-1] * 1000:>10.1f}{label_errors:>8}"
+              f"{percentile(label_waits, 0.5) * 1000:>11.1f}{percentile(label_waits, 0.99) * 1000:>11.1f}")
+
+    for label, values in sorted(latencies.items(), key=lambda item: -len(item[1])):
+        row(label, values, waits[label], errors[label])
+    row("все", list(itertools.chain(*latencies.values())), list(itertools.chain(*waits.values())), sum(errors.values()))
+    if args.outbound_limit:
+        print(f"Ограничение отправки в Telegram: {bot.outbound.stats()}")
+    print(f"Обращения к GigaChat: {gigachat_calls}, к OpenWeatherMap: {sum(weather_calls.values())}, "
+          f"к Bot API: {dict(api_calls)}")
+    print(f"Прирост RSS: {(rss_after - rss_before) / 1024:.1f} МБ (пик процесса {rss_after / 1024:.0f} МБ), "
+          f"журналов пользователей в памяти: {len(bot.user_data)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scenario", choices=["profile", "logging", "progress", "mixed"], default="mixed")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--steps", type=int, default=6, help="число записей на пользователя в сценариях logging и mixed")
+    parser.add_argument("--concurrency", type=int, default=200, help="сколько пользователей пишут одновременно")
+    parser.add_argument("--gigachat-latency", type=float, default=1.0, help="задержка ответа GigaChat, с")
+    parser.add_argument("--gigachat-concurrency", type=int, default=4)
+    parser.add_argument("--weather-latency", type=float, default=0.2, help="задержка ответа OpenWeatherMap, с")
+    parser.add_argument("--storage", choices=["memory", "sqlite"], default="memory")
+    parser.add_argument("--chart-workers", type=int, default=2)
+    parser.add_argument("--outbound-limit", action="store_true", help="включить лимиты отправки сообщений в Telegram")
+    parser.add_argument("--outbound-rate", type=float, default=30, help="лимит отправки сообщений в Telegram в секунду")
+    parser.add_argument("--outbound-chat-rate", type=float, default=1, help="лимит отправки сообщений в один чат в секунду")
+    parser.add_argument("--outbound-chat-burst", type=int, default=3, help="сколько сообщений подряд можно отправить в один чат")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        configure(args, directory)
+        sys.path.insert(0, os.getcwd())
+        asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Доля попаданий в кэш калорийности на синтетическом журнале запросов.
+
+Сравнивает прежний ключ кэша (``text.lower()``) с нормализацией и триграммным
+поиском ближайшего названия из ``names.py``. Каждый промах считается обращением
+к GigaChat, после которого название попадает в кэш. Кроме вариантов написания одних
+и тех же продуктов в журнале есть разные продукты с общим первым словом
+("курица вареная" и "курица жареная"): сопоставление одного с другим -- ошибка.
+Общее название и уточненное ("курица" и "курица жареная") ошибкой не считаются:
+калорийность общего названия -- приблизительная для любого уточнения.
+
+Запуск из корня репозитория: ``python -m benchmarks.name_index``
+"""
+import time
+import random
+import argparse
+
+from names import NameIndex, head, normalize_name
+
+FOODS = [
+    "яблоко", "банан", "хлеб", "гречка", "рис", "овсянка", "творог", "молоко", "кефир", "сыр",
+    "курица", "говядина", "свинина", "лосось", "яйцо", "картофель", "макароны", "огурец", "помидор",
+    "морковь", "апельсин", "груша", "йогурт", "сметана", "масло сливочное", "шоколад", "печенье",
+    "булочка с маком", "борщ", "пельмени", "сырники", "блины", "котлета", "салат оливье", "колбаса",
+    "сосиски", "ряженка", "мёд", "орехи грецкие", "арахис", "изюм", "персик", "киви", "виноград",
+]
+# Разные продукты с одним и тем же первым словом и разной калорийностью
+DISTINCT_FOODS = [
+    "курица вареная", "курица жареная", "картофель вареный", "картофель жареный",
+    "рис вареный", "рис жареный", "яйцо вареное", "яйцо жареное", "колбаса вареная", "колбаса копченая",
+    "сок яблочный", "сок апельсиновый", "хлеб белый", "хлеб черный", "шоколад молочный", "шоколад горький",
+    "сыр плавленый", "сыр копченый", "котлета куриная", "котлета рыбная", "капуста квашеная", "капуста тушеная",
+    "творог обезжиренный", "творог жирный", "масло подсолнечное", "масло оливковое",
+]
+ADJECTIVES = ["зеленое", "свежий", "вареный", "жареная", "домашний", "большой"]
+
+
+def vary(name, rng):
+    # Типичные расхождения в пользовательском вводе одного и того же продукта
+    variant = rng.random()
+    if variant < 0.25:
+        return name
+    if variant < 0.4:
+        return name.capitalize()
+    if variant < 0.5:
+        return name.replace("е", "ё") if "е" in name else name.replace("ё", "е")
+    if variant < 0.6:
+        return f"  {name}!"
+    if variant < 0.75 and len(name) > 4:
+        return name[:-1] + rng.choice("иыаеу")
+    if variant < 0.9 and " " not in name:
+        # Уточнение добавляется только к общему названию: "курица жареная вареный" -- уже другой запрос
+        return f"{name} {rng.choice(ADJECTIVES)}"
+    return name.upper() + "."
+
+
+def query_log(size, seed):
+    rng = random.Random(seed)
+    # Распределение Ципфа: частые продукты встречаются намного чаще редких
+    foods = FOODS + DISTINCT_FOODS
+    rng.shuffle(foods)
+    weights = [1 / rank for rank in range(1, len(foods) + 1)]
+    bases = rng.choices(foods, weights=weights, k=size)
+    return [(base, vary(base, rng)) for base in bases]
+
+
+def same_food(a, b):
+    return a == b or a == head(b) or b == head(a)
+
+
+def run_exact(queries):
+    cache = {}
+    hits = 0
+    for base, query in queries:
+        key = query.lower()
+        if key in cache:
+            hits += 1
+        else:
+            cache[key] = base
+    return hits, 0, len(cache)
+
+
+def run_index(queries, threshold):
+    cache = {}
+    index = NameIndex(threshold)
+    hits = wrong = 0
+    for base, query in queries:
+        key = normalize_name(query)
+        if key not in cache:
+            match = index.match(key)
+            key = match[0] if match is not None else None
+
+        if key is None:
+            key = normalize_name(query)
+            cache[key] = base
+            index.add(key)
+        else:
+            hits += 1
+            wrong += not same_food(cache[key], base)
+    return hits, wrong, len(cache)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=20000)
+    parser.add_argument("--threshold", type=float, default=0.6)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    queries = query_log(args.size, args.seed)
+    for name, run in [("lower()", run_exact), ("normalize + trigram", lambda q: run_index(q, args.threshold))]:
+        start = time.perf_counter()
+        hits, wrong, size = run(queries)
+        elapsed = time.perf_counter() - start
+        print(
+            f"{name:>20}: hit rate {hits / len(queries):6.2%}, GigaChat calls {len(queries) - hits:5d}, "
+            f"wrong matches {wrong:4d}, cache size {size:5d}, {elapsed / len(queries) * 1e6:6.1f} us/query"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""Память на пользователя: прежняя структура UserData против журнала на array.
+
+Запуск из корня репозитория: ``python -m benchmarks.user_data_memory``
+"""
+import random
+import argparse
+import datetime
+import tracemalloc
+from collections import defaultdict
+
+from utils import UserData
+
+
+class LegacyUserData(object):
+    # Структура UserData до перехода на журнал событий: три списка на день и словарь сумм
+    def __init__(self):
+        self.data = defaultdict(lambda: {"water": [], "calories_in": [], "calories_out": []})
+        self.sum_data = defaultdict(lambda: {"water": 0, "calories_in": 0, "calories_out": 0})
+        self.last_date = None
+
+    def append(self, d, date):
+        self.last_date = date
+        for key in ["water", "calories_in", "calories_out"]:
+            val = d.get(key, 0)
+            self.data[date][key].append(val)
+            self.sum_data[date][key] += val
+
+
+def workload(days, per_day, seed):
+    rng = random.Random(seed)
+    start = datetime.date(2026, 1, 1)
+    for offset in range(days):
+        date = (start + datetime.timedelta(days=offset)).isoformat()
+        for _ in range(per_day):
+            kind = rng.choice(["water", "water", "calories_in", "calories_out"])
+            if kind == "water":
+                yield {kind: rng.choice([150, 200, 250, 300, 500])}, date
+            else:
+                yield {kind: round(rng.uniform(50, 700), 2)}, date
+
+
+def measure(factory, users, days, per_day):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    store = {}
+    for user_id in range(users):
+        data = store[user_id] = factory()
+        for record, date in workload(days, per_day, user_id):
+            data.append(record, date)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocated = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return allocated / users
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--per-day", type=int, default=8)
+    args = parser.parse_args()
+
+    legacy = measure(LegacyUserData, args.users, args.days, args.per_day)
+    compact = measure(UserData, args.users, args.days, args.per_day)
+    print(f"{args.users} пользователей, {args.days} дней, {args.per_day} записей в день")
+    print(f"  прежний UserData: {legacy / 1024:8.1f} КБ на пользователя")
+    print(f"  журнал на array:  {compact / 1024:8.1f} КБ на пользователя ({legacy / compact:.1f}x меньше)")
+
+
+if __name__ == "__main__":
+    main()
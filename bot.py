@@ -1,15 +1,31 @@
 import os
 import re
+import math
+import time
 import asyncio
+import datetime
 from logger import logger
 from dotenv import load_dotenv
-from collections import defaultdict
 from aiogram import Bot, Dispatcher
 from aiogram.types import BotCommand, CallbackQuery
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.client.session.aiohttp import AiohttpSession
 
 from aiogram import types
-from utils import gigachat_call, get_temp, UserData
+from llm import gigachat_call, gigachat_batch_call, breaker as gigachat_breaker, pool as gigachat_pool, prewarm as prewarm_llm
+from cache import KnowledgeCache, KnowledgeStore, MemoryBoundedCache, SingleFlight
+from utils import UserData
+from weather import WeatherClient
+from goals import GoalEngine, base_water, heat_water, base_calories
+from names import NameIndex, normalize_name
+from food_table import FoodTable
+from charts import HISTORY_DAYS, render_stat, prewarm as prewarm_charts, shutdown as shutdown_charts
+from storage import WriteBehindQueue, create_storage
+from webhook import create_app, serve
+import metrics
+from throttling import ThrottlingMiddleware, parse_limits
+from outbound import OutboundLimiter, SendQueue
+from scheduler import ActivityMiddleware, Scheduler, parse_times
 
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
@@ -17,8 +33,74 @@ from aiogram.fsm.state import State, StatesGroup
 
 load_dotenv()
 
-bot = Bot(token=os.environ.get("BOT_TOKEN"))
-dp = Dispatcher(storage=MemoryStorage())
+KNOWLEDGE_DB_PATH = os.environ.get("KNOWLEDGE_DB_PATH", "data/knowledge.sqlite3")
+KNOWLEDGE_CACHE_SIZE = int(os.environ.get("KNOWLEDGE_CACHE_SIZE", 10000))
+KNOWLEDGE_CACHE_TTL_DAYS = float(os.environ.get("KNOWLEDGE_CACHE_TTL_DAYS", 90))
+NAME_MATCH_THRESHOLD = float(os.environ.get("NAME_MATCH_THRESHOLD", 0.6))
+FOOD_TABLE_DIR = os.environ.get("FOOD_TABLE_DIR", "data")
+CHART_CACHE_MB = float(os.environ.get("CHART_CACHE_MB", 64))
+STORAGE_URL = os.environ.get("STORAGE_URL", "memory")
+WRITE_BATCH_SIZE = int(os.environ.get("WRITE_BATCH_SIZE", 500))
+WRITE_FLUSH_INTERVAL = float(os.environ.get("WRITE_FLUSH_INTERVAL", 1.0))
+WEATHER_TTL_MINUTES = float(os.environ.get("WEATHER_TTL_MINUTES", 30))
+WEATHER_TIMEOUT = float(os.environ.get("WEATHER_TIMEOUT", 5))
+# Режим получения обновлений: "polling" (по умолчанию) или "webhook"
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_BASE_URL = os.environ.get("WEBHOOK_BASE_URL")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", 8080))
+WEBHOOK_MAX_CONCURRENCY = int(os.environ.get("WEBHOOK_MAX_CONCURRENCY", 64))
+WEBHOOK_MAX_PENDING = int(os.environ.get("WEBHOOK_MAX_PENDING", 1000))
+WEBHOOK_DRAIN_TIMEOUT = float(os.environ.get("WEBHOOK_DRAIN_TIMEOUT", 30))
+# Адрес Bot API, например локального сервера или фейка из fake_telegram.py
+TELEGRAM_API_URL = os.environ.get("TELEGRAM_API_URL")
+# Метрики: в режиме webhook отдаются сервером вебхука, в режиме polling -- отдельным сервером на METRICS_PORT
+METRICS_PATH = os.environ.get("METRICS_PATH", "/metrics")
+METRICS_HOST = os.environ.get("METRICS_HOST", "0.0.0.0")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+# Загрузить клиент GigaChat и процессы отрисовки графиков в фоне сразу после запуска,
+# а не при первом запросе пользователя
+PREWARM = os.environ.get("PREWARM", "1") == "1"
+# Пользователи, которым доступна команда /stats, через запятую
+ADMIN_IDS = {int(user_id) for user_id in os.environ.get("ADMIN_IDS", "").split(",") if user_id.strip()}
+# Лимиты запросов в минуту на пользователя: общий (default) и для дорогих команд
+THROTTLE_LIMITS = parse_limits(os.environ.get("THROTTLE_LIMITS", "default=30,log_food=6,log_workout=6,check_progress=3"))
+# Фоновые задачи: начало нового дня и напоминания о воде (время суток через запятую, пусто -- выключены),
+# скорость рассылки напоминаний в сообщениях в секунду
+ROLLOVER_TIME = parse_times(os.environ.get("ROLLOVER_TIME", "0:00"))
+REMINDER_TIMES = parse_times(os.environ.get("REMINDER_TIMES", "13:00,18:00"))
+REMINDER_RATE = float(os.environ.get("REMINDER_RATE", 10))
+# Прогрев кэшей погоды и GigaChat: раз в PREWARM_INTERVAL секунд, если бот простаивает IDLE_SECONDS секунд,
+# не больше PREWARM_BATCH городов и продуктов за раз
+IDLE_SECONDS = float(os.environ.get("IDLE_SECONDS", 60))
+PREWARM_INTERVAL = float(os.environ.get("PREWARM_INTERVAL", 300))
+PREWARM_BATCH = int(os.environ.get("PREWARM_BATCH", 20))
+# Лимиты отправки сообщений в Telegram: всего в секунду, в один чат в секунду и подряд,
+# и сколько раз повторять запрос после ответа RetryAfter
+OUTBOUND_RATE = float(os.environ.get("OUTBOUND_RATE", 30))
+OUTBOUND_CHAT_RATE = float(os.environ.get("OUTBOUND_CHAT_RATE", 1))
+OUTBOUND_CHAT_BURST = int(os.environ.get("OUTBOUND_CHAT_BURST", 3))
+OUTBOUND_RETRIES = int(os.environ.get("OUTBOUND_RETRIES", 3))
+
+session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+bot = Bot(token=os.environ.get("BOT_TOKEN"), session=session)
+outbound = OutboundLimiter(OUTBOUND_RATE, OUTBOUND_CHAT_RATE, OUTBOUND_CHAT_BURST, OUTBOUND_RETRIES)
+bot.session.middleware(outbound)
+storage = create_storage(STORAGE_URL)
+writer = WriteBehindQueue(storage, WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL)
+dp = Dispatcher(storage=storage.fsm)
+scheduler = Scheduler(IDLE_SECONDS)
+send_queue = SendQueue(bot, REMINDER_RATE)
+activity = ActivityMiddleware(scheduler)
+dp.message.outer_middleware(activity)
+dp.callback_query.outer_middleware(activity)
+throttling = ThrottlingMiddleware(THROTTLE_LIMITS, exempt=ADMIN_IDS)
+dp.message.outer_middleware(throttling)
+dp.callback_query.outer_middleware(throttling)
+dp.message.middleware(metrics.MetricsMiddleware())
+dp.callback_query.middleware(metrics.MetricsMiddleware())
 
 
 async def set_commands():
@@ -28,7 +110,7 @@ async def set_commands():
         BotCommand(command="/set_profile", description="Настроить профиль"),
         BotCommand(command="/profile", description="Показать профиль"),
         BotCommand(command="/log_water", description="Логировать воду. Пример: /log_water 500"),
-        BotCommand(command="/log_food", description="Логировать еду. Пример: /log_food Булочка с маком"),
+        BotCommand(command="/log_food", description="Логировать еду. Пример: /log_food яблоко 150, хлеб 50"),
         BotCommand(command="/log_workout", description="Логировать тренировку. Пример: /log_workout жим лежа 10"),
         BotCommand(command="/check_progress", description="Проверить прогресс")
     ]
@@ -36,10 +118,167 @@ async def set_commands():
     logger.info("Команды бота установлены.")
 
 
-user_data = defaultdict(UserData)
-user_profiles = {}
-food_info = {}
-workout_info = {}
+# Журналы пользователей, уже загруженные в этот процесс из storage
+user_data = {}
+# Позиция в журнале хранилища, до которой журнал пользователя в процессе с ним сверен
+event_positions = {}
+# Фоновые задачи, на которые нужно держать ссылку до их завершения
+background_tasks = set()
+food_table = FoodTable.load(FOOD_TABLE_DIR, NAME_MATCH_THRESHOLD)
+knowledge_store = KnowledgeStore(KNOWLEDGE_DB_PATH)
+food_info = KnowledgeCache(
+    "food", KNOWLEDGE_CACHE_SIZE, KNOWLEDGE_CACHE_TTL_DAYS * 86400, knowledge_store, NameIndex(NAME_MATCH_THRESHOLD)
+)
+workout_info = KnowledgeCache(
+    "workout", KNOWLEDGE_CACHE_SIZE, KNOWLEDGE_CACHE_TTL_DAYS * 86400, knowledge_store, NameIndex(NAME_MATCH_THRESHOLD)
+)
+weather = WeatherClient(os.environ.get("OWM_API_KEY"), knowledge_store, WEATHER_TTL_MINUTES * 60, WEATHER_TIMEOUT)
+food_flight = SingleFlight("food")
+workout_flight = SingleFlight("workout")
+chart_cache = MemoryBoundedCache(int(CHART_CACHE_MB * 1024 * 1024))
+chart_flight = SingleFlight("chart")
+
+
+async def update_temperature(city):
+    try:
+        goal_engine.update_temperature(city, await weather.get_temp(city))
+    except Exception:
+        logger.exception("Не удалось обновить температуру для города %s", city)
+
+
+def refresh_temperature(city):
+    # Погода запрашивается в фоне: ответ пользователю не ждет OpenWeatherMap
+    task = asyncio.create_task(update_temperature(city))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
+goal_engine = GoalEngine(storage, refresh_temperature, WEATHER_TTL_MINUTES * 60)
+weather.listeners.append(goal_engine.update_temperature)
+
+metrics.registry.register_stats("cache", "food", food_info.stats)
+metrics.registry.register_stats("cache", "workout", workout_info.stats)
+metrics.registry.register_stats("cache", "geo", weather.coordinates.stats)
+metrics.registry.register_stats("cache", "temperature", weather.temperatures.stats)
+metrics.registry.register_stats("cache", "chart", chart_cache.stats)
+metrics.registry.register_stats("cache", "goals", goal_engine.stats)
+metrics.registry.register_stats("single_flight", "food", food_flight.stats)
+metrics.registry.register_stats("single_flight", "workout", workout_flight.stats)
+metrics.registry.register_stats("single_flight", "weather", weather.flight.stats)
+metrics.registry.register_stats("single_flight", "chart", chart_flight.stats)
+metrics.registry.register_stats("write_queue", "events", writer.stats)
+metrics.registry.register_stats("send_queue", "reminders", send_queue.stats)
+metrics.registry.register_stats("outbound", "telegram", outbound.stats)
+metrics.registry.register_stats("gigachat", "pool", gigachat_pool.stats)
+metrics.registry.register_stats("gigachat", "breaker", gigachat_breaker.stats)
+
+# Правдоподобные значения ответов GigaChat: ккал на 100 г продукта и ккал за минуту тренировки
+FOOD_KCAL_RANGE = (0, 900)
+WORKOUT_KCAL_RANGE = (0.5, 30)
+
+
+async def fetch_calories(cache, key, prompt, limits):
+    # Выполняется один раз на все одновременные запросы с тем же ключом (см. SingleFlight);
+    # повторы и проверку ответа выполняет llm.gigachat_call
+    calories_info = await gigachat_call(prompt, *limits)
+    if not isinstance(calories_info, str):
+        cache.set(key, calories_info)
+    return calories_info
+
+
+async def fetch_calories_batch(cache, foods):
+    # Один запрос к GigaChat на все продукты приема пищи, которых нет в таблице и кэше
+    prompt = (
+        "Сколько килокалорий содержится в 100 граммах каждого продукта из списка: "
+        f"{', '.join(foods)}? Ответ дай только JSON-объектом, где ключ -- название продукта "
+        "из списка без изменений, а значение -- одно число, без текста или единиц измерения."
+    )
+    calories = await gigachat_batch_call(prompt, foods, *FOOD_KCAL_RANGE)
+    if isinstance(calories, str):
+        return {}
+    for food, calories_info in calories.items():
+        cache.set(food, calories_info)
+    return calories
+
+
+async def lookup_foods(foods):
+    """Калорийность на 100 г для каждого продукта: {продукт: (найденное название, ккал)}.
+
+    Сначала встроенная таблица, затем кэш ответов GigaChat; все оставшиеся продукты
+    запрашиваются у GigaChat одним запросом. Не определенные продукты в ответ не попадают.
+    """
+    found = {}
+    missing = []
+    # Точные совпадения с таблицей -- одним векторизованным проходом на весь прием пищи,
+    # ближайшие по названию и кэш -- только для продуктов, которых в таблице нет
+    for food, kcal in zip(foods, food_table.lookup_many(foods)):
+        if not math.isnan(kcal):
+            found[food] = (food, int(kcal))
+            continue
+        match = food_table.match(food) or food_info.find(food)
+        if match is not None:
+            found[food] = match
+        elif food not in missing:
+            missing.append(food)
+
+    if missing:
+        logger.info("Обращение к Gigachat для расчета калорийности: %s", missing)
+        key = tuple(sorted(missing))
+        calories = await food_flight.do(key, lambda: fetch_calories_batch(food_info, missing))
+        for food, kcal in calories.items():
+            found[food] = (food, kcal)
+    return found
+
+
+def parse_meal(text):
+    """'яблоко 150, хлеб 50 г' -> [('яблоко', 150), ('хлеб', 50)]; без граммовки вместо числа None."""
+    items = []
+    for part in re.split(r"[,;\n]+", text):
+        match = re.fullmatch(r"\s*(.+?)(?:\s+(\d+)\s*(?:г|гр|грамм\w*)?\.?)?\s*", part)
+        if match is not None:
+            grams = match.group(2)
+            items.append((normalize_name(match.group(1)), int(grams) if grams else None))
+    return [(food, grams) for food, grams in items if food]
+
+
+async def get_user_data(user_id):
+    if user_id not in user_data:
+        position, events = await storage.load_events(user_id)
+        # Пока шла загрузка, журнал мог загрузить параллельный запрос того же пользователя
+        if user_id not in user_data:
+            data = UserData()
+            data.restore(events)
+            user_data[user_id] = data
+            event_positions[user_id] = position
+    elif storage.shared:
+        # Обновления пользователя могли обработать другие процессы: дочитываем их события,
+        # уже записанные в хранилище (они появляются там через WRITE_FLUSH_INTERVAL)
+        old_position = event_positions[user_id]
+        position, events = await storage.load_events(user_id, old_position)
+        # Те же события мог уже применить параллельный запрос того же пользователя
+        if event_positions[user_id] == old_position:
+            if events:
+                user_data[user_id].restore(events)
+            event_positions[user_id] = position
+    return user_data[user_id]
+
+
+async def record(user_id, d):
+    data = await get_user_data(user_id)
+    events = data.append(d)
+    # Запись на диск откладывается и выполняется пачкой в фоне (см. WriteBehindQueue)
+    writer.put([(user_id, *event) for event in events])
+    return data
+
+
+async def get_progress_charts(user_id, data, goal_calories, goal_water):
+    # Пока пользователь ничего не записал, повторный запрос отдает уже нарисованные графики
+    key = (user_id, *data.version(), goal_calories, goal_water)
+    images = chart_cache.get(key)
+    if images is None:
+        images = await chart_flight.do(key, lambda: render_stat(data, goal_calories, goal_water))
+        chart_cache.set(key, images, sum(len(image) for image in images))
+    return images
 
 
 class ProfileForm(StatesGroup):
@@ -57,33 +296,41 @@ class ProfileForm(StatesGroup):
 @dp.message(Command('start'))
 async def cmd_start(message: types.Message):
     user_id = message.from_user.id
-    logger.info(f"Пользователь {user_id} начал взаимодействие с ботом.")
+    logger.info("Пользователь %s начал взаимодействие с ботом.", user_id)
     await message.answer("Привет! Я бот, который поможет тебе заполнить профиль. Используй /set_profile, чтобы начать.")
 
 
 @dp.message(Command('help'))
 async def cmd_help(message: types.Message):
-    logger.info(f"Пользователь {message.from_user.id} запросил справку.")
+    logger.info("Пользователь %s запросил справку.", message.from_user.id)
     await message.answer("Вот список доступных команд:\n/start - Запустить бота\n/help - Показать справку\n/set_profile - Настроить профиль")
 
 
 @dp.message(Command('profile'))
 async def cmd_profile(message: types.Message):
     user_id = message.from_user.id
-    logger.info(f"Пользователь {user_id} запросил свой профиль.")
+    logger.info("Пользователь %s запросил свой профиль.", user_id)
 
-    profile = user_profiles.get(user_id)
+    # Цели берутся из GoalEngine, а не из профиля: норма воды в профиле рассчитана при настройке,
+    # а текущая учитывает погоду в городе и сегодняшние тренировки
+    goals = await goal_engine.get(user_id)
 
-    if profile:
+    if goals is not None:
+        profile = goals.profile
         sex = profile['sex']
         weight = profile['weight']
         height = profile['height']
         age = profile['age']
         activity = profile['activity']
         city = profile['city']
-        calories = profile['calories']
+        calories = goals.calories
         cpa = profile['cpa']
-        water = profile['water']
+        water = goals.water
+        bonuses = []
+        if goals.heat_water:
+            bonuses.append(f"жара +{goals.heat_water}")
+        if goals.workout_water:
+            bonuses.append(f"тренировки +{goals.workout_water}")
 
         profile_message = (
             f"📋 Ваш профиль:\n\n"
@@ -95,8 +342,10 @@ async def cmd_profile(message: types.Message):
             f"🌍 Город: {city}\n"
             f"🍏 Цель калорий: {calories} ккал/день\n"
             f"💪🏻 Приблизительный КФА: {cpa}\n"
-            f"🧊 Цель воды: {water} мл/день"
+            f"🧊 Цель воды на сегодня: {water} мл"
         )
+        if bonuses:
+            profile_message += f" ({', '.join(bonuses)})"
 
         await message.answer(profile_message)
     else:
@@ -106,7 +355,7 @@ async def cmd_profile(message: types.Message):
 @dp.message(Command('set_profile'))
 async def cmd_set_profile(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    logger.info(f"Пользователь {user_id} начал настройку профиля.")
+    logger.info("Пользователь %s начал настройку профиля.", user_id)
 
     sex_choices = types.InlineKeyboardMarkup(inline_keyboard=[
             [types.InlineKeyboardButton(text="Мужской", callback_data='мужской')],
@@ -123,7 +372,7 @@ async def process_sex(call: CallbackQuery, state: FSMContext):
     # sex = message.text.lower()
     sex = call.data
 
-    logger.info(f"Пользователь {user_id} ввел пол: {sex}")
+    logger.info("Пользователь %s ввел пол: %s", user_id, sex)
     await state.update_data(sex=sex)
     await call.message.answer(f"Ваш пол: {sex}. Сколько вы весите в килограммах?")
     await state.set_state(ProfileForm.waiting_for_weight)
@@ -134,7 +383,7 @@ async def process_weight(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     try:
         weight = int(message.text)
-        logger.info(f"Пользователь {user_id} ввел вес: {weight} кг.")
+        logger.info("Пользователь %s ввел вес: %s кг.", user_id, weight)
         await state.update_data(weight=weight)
         await message.answer(f"Ваш вес: {weight} кг. Какой ваш рост в сантиметрах?")
         await state.set_state(ProfileForm.waiting_for_height)
@@ -147,7 +396,7 @@ async def process_height(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     try:
         height = int(message.text)
-        logger.info(f"Пользователь {user_id} ввел рост: {height} см.")
+        logger.info("Пользователь %s ввел рост: %s см.", user_id, height)
         await state.update_data(height=height)
         await message.answer(f"Ваш рост: {height} см. Сколько вам лет?")
         await state.set_state(ProfileForm.waiting_for_age)
@@ -160,7 +409,7 @@ async def process_age(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     try:
         age = int(message.text)
-        logger.info(f"Пользователь {user_id} ввел возраст: {age} лет.")
+        logger.info("Пользователь %s ввел возраст: %s лет.", user_id, age)
         await state.update_data(age=age)
         await message.answer(f"Ваш возраст: {age} лет. В каком городе вы живете?")
         await state.set_state(ProfileForm.waiting_for_city)
@@ -172,7 +421,7 @@ async def process_age(message: types.Message, state: FSMContext):
 async def process_city(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     city = message.text.strip()
-    logger.info(f"Пользователь {user_id} ввел город: {city}.")
+    logger.info("Пользователь %s ввел город: %s.", user_id, city)
     await state.update_data(city=city)
     await message.answer(f"Ваш город: {city}. Сколько минут в день вы тратите на активность? (Если активность отсутствует, укажите \"0\").")
     await state.set_state(ProfileForm.waiting_for_activity)
@@ -184,7 +433,7 @@ async def process_activity(message: types.Message, state: FSMContext):
     try:
         activity = int(message.text)
         cpa = min(1.2 + activity // 10 * 0.1, 2.4) # коэффициент физической активности, КФА
-        logger.info(f"Пользователь {user_id} ввел уровень активности: {activity} минут.")
+        logger.info("Пользователь %s ввел уровень активности: %s минут.", user_id, activity)
         await state.update_data(activity=activity)
         await state.update_data(cpa=cpa)
         await message.answer(f"Уровень активности: {activity} минут. Теперь укажите целевое количество воды в день в мл (или введите \"-\" для автоматического расчета).")
@@ -200,27 +449,26 @@ async def process_water(message: types.Message, state: FSMContext):
 
     if user_input.isdigit():
         water = int(user_input)
-        logger.info(f"Пользователь {user_id} указал цель воды вручную: {water} мл.")
+        logger.info("Пользователь %s указал цель воды вручную: %s мл.", user_id, water)
+        await state.update_data(water_auto=False)
     else:
-        logger.info(f"Пользователь {user_id} не указал цель воды, рассчитываем автоматически.")
+        logger.info("Пользователь %s не указал цель воды, рассчитываем автоматически.", user_id)
         state_data = await state.get_data()
         weight = int(state_data.get('weight'))
         is_male = (state_data.get('sex').lower() == "мужской")
         activity = int(state_data.get('activity'))
 
         try:
-            temperature = await get_temp(state_data.get('city'))
-            logger.info(f"Температура в городе {state_data.get('city')} пользователя {user_id}: {temperature} градусов")
-            is_heat = (temperature >= 25)
+            temperature = await weather.get_temp(state_data.get('city'))
+            logger.info("Температура в городе %s пользователя %s: %s градусов", state_data.get('city'), user_id, temperature)
         except:
-            logger.info(f"Для города {state_data.get('city')} пользователя {user_id} не удалось получить температуру")
-            is_heat = False
-
-        base_water = weight * 30 + 500 * is_male
-        activity_water = (activity // 30) * 500
-        weather_water = 500 * is_heat
+            logger.info("Для города %s пользователя %s не удалось получить температуру", state_data.get('city'), user_id)
+            temperature = None
 
-        water = base_water + activity_water + weather_water
+        # Надбавка за жару не сохраняется в профиле: ее пересчитывает goal_engine при смене погоды
+        water_base = base_water(weight, is_male, activity)
+        water = water_base + heat_water(temperature)
+        await state.update_data(water_auto=True, water_base=water_base)
 
     await state.update_data(water=water)
     await message.answer(f"Ваша цель по воде: {water} мл/день.")
@@ -243,17 +491,13 @@ async def process_calories(message: types.Message, state: FSMContext):
 
     if user_input.isdigit():
         calories = int(user_input)
-        logger.info(f"Пользователь {user_id} указал цель калорий вручную: {calories}.")
+        logger.info("Пользователь %s указал цель калорий вручную: %s.", user_id, calories)
     else:
-        logger.info(f"Пользователь {user_id} не указал цель калорий, рассчитываем автоматически.")
-        # На основе формулы Харриса-Бенедикта (добавлен КФА)
-        if sex == "мужской":
-            calories = int((66.5 + 13.75 * weight + 5.003 * height - 6.775 * age) * cpa)
-        else:
-            calories = int((655.1 + 9.563 * weight + 1.85 * height - 4.676 * age) * 0.9 * cpa)
+        logger.info("Пользователь %s не указал цель калорий, рассчитываем автоматически.", user_id)
+        calories = base_calories(sex, weight, height, age, cpa)
 
     # Сохраняем профиль пользователя
-    user_profiles[user_id] = {
+    profile = {
         'sex': sex,
         'weight': weight,
         'height': height,
@@ -261,9 +505,13 @@ async def process_calories(message: types.Message, state: FSMContext):
         'activity': activity,
         'city': state_data.get('city'),
         'water': state_data.get('water'),
+        'water_auto': state_data.get('water_auto'),
+        'water_base': state_data.get('water_base'),
         'calories': calories,
         'cpa': cpa,
     }
+    await storage.set_profile(user_id, profile)
+    goal_engine.set_profile(user_id, profile)
 
     await message.answer(f"Ваша цель по калориям: {calories} ккал/день.")
     await message.answer("Ваш профиль настроен! Вы можете запросить его с помощью команды /profile.")
@@ -275,53 +523,96 @@ async def cmd_log_water(message: types.Message):
     user_id = message.from_user.id
     try:
         amount = int(message.text.split()[1])
-        logger.info(f"Пользователь {user_id} указал потребление {amount} мл жидкости.")
+        logger.info("Пользователь %s указал потребление %s мл жидкости.", user_id, amount)
 
-        user_data[user_id].append({"water": amount})
-        profile = user_profiles.get(user_id)
-        goal = profile.get("water")
-        remaining = max(goal - user_data[user_id]["water"], 0)
+        data = await record(user_id, {"water": amount})
+        goal = (await goal_engine.get(user_id)).water
+        remaining = max(goal - data["water"], 0)
         if remaining > 0:
             await message.answer(f"Записано: {amount} мл воды. Осталось: {remaining} мл до выполнения нормы.")
         else:
-            logger.info(f"Пользователь {user_id} выполнил норму: {goal} мл жидкости.")
+            logger.info("Пользователь %s выполнил норму: %s мл жидкости.", user_id, goal)
             await message.answer(f"Записано: {amount} мл воды. Поздравляю! Вы выполнили норму")
         return
     except Exception as e:
-        logger.exception(f"Получено исключение:\n{e}")
+        logger.exception("Получено исключение:\n%s", e)
         await message.answer("Пожалуйста, укажите количество воды в миллилитрах. Пример: /log_water 120")
 
 
 @dp.message(Command('log_food'))
 async def cmd_log_food(message: types.Message, state: FSMContext):
     try:
-        food = message.text.split(maxsplit=1)[1].lower()
-        logger.info(f"Пользователь {message.from_user.id} указал потребление еды: {food}")
-        if food in food_info:
-            calories_info = food_info[food]
-            logger.info(f"Энергетическая ценность {food} была предзагружена: {calories_info} ккал")
+        items = parse_meal(message.text.split(maxsplit=1)[1])
+        if len(items) > 1 or items[0][1] is not None:
+            await log_meal(message, items)
+            return
+
+        food = items[0][0]
+        logger.info("Пользователь %s указал потребление еды: %s", message.from_user.id, food)
+        # Сначала встроенная таблица, затем кэш ответов GigaChat, и только потом сам GigaChat
+        found = food_table.find(food) or food_info.find(food)
+        if found is not None:
+            food, calories_info = found
+            logger.info("Энергетическая ценность %s была предзагружена: %s ккал", food, calories_info)
         else:
-            logger.info(f"Обращение к Gigachat для расчета калорийности {food}")
-            prompt = f"Сколько килокалорий содержится в 100 граммах {food}? Ответ дай только числом, без текста или единиц измерения."
-            for retry in range(3):
-                calories_info = await gigachat_call(prompt)
-                if type(calories_info) is int:
-                    break
+            logger.info("Обращение к Gigachat для расчета калорийности %s", food)
+            prompt = f"Сколько килокалорий содержится в 100 граммах {food}? Ответ дай только JSON-объектом вида {{\"value\": число}}, без текста или единиц измерения."
+            calories_info = await food_flight.do(food, lambda: fetch_calories(food_info, food, prompt, FOOD_KCAL_RANGE))
 
             if isinstance(calories_info, str):
-                logger.exception(f"Получено исключение:\nНе удалось определить энергетическую ценность для указанного продукта: {food}")
+                logger.exception("Получено исключение:\nНе удалось определить энергетическую ценность для указанного продукта: %s", food)
                 await message.answer(f"Не удалось определить энергетическую ценность для указанного продукта: {food}")
                 return
 
-            food_info[food] = calories_info
-
         await message.answer(f"{food.capitalize()} — {calories_info} ккал на 100 г. Сколько грамм вы употребили? (Запишите ответ одним числом)")
         await state.update_data(calories_info=calories_info, food=food)
         await state.set_state(ProfileForm.waiting_for_food_amout)
 
     except Exception as e:
-        logger.exception(f"Получено исключение:\n{e}")
-        await message.answer("Не удалось обработать ответ. Повторите вызов функции. Пример: /log_food яблоко")
+        logger.exception("Получено исключение:\n%s", e)
+        await message.answer("Не удалось обработать ответ. Повторите вызов функции. Пример: /log_food яблоко или /log_food яблоко 150, хлеб 50")
+
+
+async def log_meal(message: types.Message, items):
+    # Несколько продуктов с граммовкой в одной команде: без уточняющих вопросов и одной записью в журнал
+    user_id = message.from_user.id
+    if any(grams is None for food, grams in items):
+        await message.answer("Укажите граммовку для каждого продукта. Пример: /log_food яблоко 150, хлеб 50, сыр 30")
+        return
+
+    logger.info("Пользователь %s указал прием пищи: %s", user_id, items)
+    found = await lookup_foods([food for food, grams in items])
+
+    lines = []
+    failed = []
+    total_calories = 0
+    for food, grams in items:
+        if food not in found:
+            failed.append(food)
+            continue
+        name, calories_info = found[food]
+        calories = calories_info * grams / 100
+        total_calories += calories
+        lines.append(f"- {name.capitalize()}, {grams} г — {calories:.2f} ккал ({calories_info} ккал на 100 г)")
+
+    if failed:
+        logger.info("Для пользователя %s не удалось определить энергетическую ценность: %s", user_id, failed)
+        lines.append(f"Не удалось определить энергетическую ценность: {', '.join(failed)}")
+    if len(failed) == len(items):
+        await message.answer("\n".join(lines))
+        return
+
+    data = await record(user_id, {"calories_in": total_calories})
+    logger.info("Пользователь %s записал прием пищи на %s ккал.", user_id, total_calories)
+
+    goal = (await goal_engine.get(user_id)).calories
+    remaining = max(goal - data["calories_in"], 0)
+    if remaining > 0:
+        lines.append(f"Записано: {total_calories:.2f} ккал. Осталось: {remaining} ккал до выполнения нормы.")
+    else:
+        logger.info("Пользователь %s выполнил норму по потреблению пищи: %s ккал", user_id, goal)
+        lines.append(f"Записано: {total_calories:.2f} ккал. Поздравляю! Вы выполнили норму")
+    await message.answer("\n".join(lines))
 
 
 @dp.message(ProfileForm.waiting_for_food_amout)
@@ -332,22 +623,21 @@ async def process_food_amount(message: types.Message, state: FSMContext):
     try:
         amount = int(message.text)
         total_calories = (calories_info * amount) / 100
-        logger.info(f"Пользователь {user_id} указал потребление еды: {state_data.get('food')} в объеме {amount} г. Расчетная калорийность: {total_calories} ккал.")
-        user_data[user_id].append({"calories_in": total_calories})
+        logger.info("Пользователь %s указал потребление еды: %s в объеме %s г. Расчетная калорийность: %s ккал.", user_id, state_data.get('food'), amount, total_calories)
+        data = await record(user_id, {"calories_in": total_calories})
 
-        profile = user_profiles.get(user_id)
-        goal = profile.get("calories")
-        remaining = max(goal - user_data[user_id]["calories_in"], 0)
+        goal = (await goal_engine.get(user_id)).calories
+        remaining = max(goal - data["calories_in"], 0)
         if remaining > 0:
             await message.answer(f"Записано: {total_calories:.2f} ккал. Осталось: {remaining} ккал до выполнения нормы.")
         else:
-            logger.info(f"Пользователь {user_id} выполнил норму по потреблению пищи: {goal} ккал")
+            logger.info("Пользователь %s выполнил норму по потреблению пищи: %s ккал", user_id, goal)
             await message.answer(f"Записано: {total_calories:.2f} ккал. Поздравляю! Вы выполнили норму")
         await state.clear()
         return
 
     except Exception as e:
-        logger.exception(f"Получено исключение:\n{e}")
+        logger.exception("Получено исключение:\n%s", e)
         await message.answer("Пожалуйста, укажите количество грамм одним числом.")
 
 
@@ -356,54 +646,54 @@ async def cmd_log_workout(message: types.Message):
     user_id = message.from_user.id
     try:
         parts = re.search(r"log_workout ([\w\s]+) (\d+)", message.text)
-        action = parts.group(1).strip().lower()
+        action = normalize_name(parts.group(1))
         duration = int(parts.group(2))
-        logger.info(f"Пользователь {user_id} провел тренировку {action} в течение {duration} минут.")
+        logger.info("Пользователь %s провел тренировку %s в течение %s минут.", user_id, action, duration)
 
-        calories_info = None
-        if action in workout_info:
-            calories_info = workout_info[action]
-            logger.info(f"Энергетическое потребление {action} было предзагружено: {calories_info} ккал за минуту")
+        found = workout_info.find(action)
+        if found is not None:
+            action, calories_info = found
+            logger.info("Энергетическое потребление %s было предзагружено: %s ккал за минуту", action, calories_info)
         else:
-            logger.info(f"Обращение к Gigachat для расчета энергопотребления {action}")
-            prompt = f"Сколько килокалорий сжигается за 1 минуту {action}? Ответ дай только одним числом, без какого либо текста и единиц измерения."
-            for retry in range(3):
-                calories_info = await gigachat_call(prompt)
-                if type(calories_info) is int:
-                    break
+            logger.info("Обращение к Gigachat для расчета энергопотребления %s", action)
+            prompt = f"Сколько килокалорий сжигается за 1 минуту {action}? Ответ дай только JSON-объектом вида {{\"value\": число}}, без какого либо текста и единиц измерения."
+            calories_info = await workout_flight.do(action, lambda: fetch_calories(workout_info, action, prompt, WORKOUT_KCAL_RANGE))
 
             if isinstance(calories_info, str):
-                logger.exception(f"Получено исключение:\nНе удалось определить затраты энергии для тренировки: {action}")
+                logger.exception("Получено исключение:\nНе удалось определить затраты энергии для тренировки: %s", action)
                 await message.answer(f"Не удалось определить затраты энергии для тренировки: {action}")
                 return
 
         calories_burned = calories_info * duration
-        user_data[user_id].append({"calories_out": calories_burned})
-        additional_water = (duration // 30) * 200
-        logger.info(f"Расчетное потребление энергии пользователем {user_id} за тренировку {action} в течение {duration} минут: {calories_burned} ккал. Дополнительный объем жидкости: {additional_water} мл")
-
-        await message.answer(
-            f"{action.capitalize()} {duration} минут — {calories_burned} ккал.\nДополнительно: выпейте {additional_water} мл воды."
-        )
+        await record(user_id, {"calories_out": calories_burned})
+        # Надбавка сразу входит в сегодняшнюю норму воды, которую видят /log_water и /check_progress
+        additional_water, goals = await goal_engine.add_workout(user_id, duration)
+        logger.info("Расчетное потребление энергии пользователем %s за тренировку %s в течение %s минут: %s ккал. Дополнительный объем жидкости: %s мл", user_id, action, duration, calories_burned, additional_water)
+
+        answer = f"{action.capitalize()} {duration} минут — {calories_burned} ккал.\nДополнительно: выпейте {additional_water} мл воды."
+        if additional_water and goals is not None:
+            answer += f" Норма воды на сегодня: {goals.water} мл."
+        await message.answer(answer)
         return
     except Exception as e:
-        logger.exception(f"Получено исключение:\n{e}")
+        logger.exception("Получено исключение:\n%s", e)
         await message.answer("Пожалуйста, укажите тип тренировки и длительность в минутах. Пример: /log_workout приседания 15")
 
 
 @dp.message(Command('check_progress'))
 async def cmd_check_progress(message: types.Message):
     user_id = message.from_user.id
-    logger.info(f"Пользователь {user_id} запросил визуализацию прогресса")
+    logger.info("Пользователь %s запросил визуализацию прогресса", user_id)
 
-    profile = user_profiles.get(user_id)
-    goal_water = profile.get("water")
-    goal_calories = profile.get("calories")
+    goals = await goal_engine.get(user_id)
+    goal_water = goals.water
+    goal_calories = goals.calories
 
-    if user_id in user_data:
-        water_consumed = user_data[user_id]["water"]
-        calories_in = user_data[user_id]["calories_in"]
-        calories_out = user_data[user_id]["calories_out"]
+    data = await get_user_data(user_id)
+    if len(data):
+        water_consumed = data["water"]
+        calories_in = data["calories_in"]
+        calories_out = data["calories_out"]
         progress_message = (
             f"📊 Прогресс:\n\n"
             f"Вода:\n"
@@ -414,34 +704,166 @@ async def cmd_check_progress(message: types.Message):
             f"- Сожжено: {calories_out} ккал.\n"
             f"- Баланс: {abs(calories_in - calories_out)} ккал.\n"
         )
-
-        img_files = user_data[user_id].draw_stat(goal_calories, goal_water)
-        if len(img_files) == 1:
-            logger.info(f"Для пользователя {user_id} выведен один график: накопительная динамика за последнюю дату {user_data[user_id].last_date}")
+        # Суммы за неделю и месяц поддерживаются при каждой записи и не требуют обхода журнала
+        for title, totals in (("За неделю", data.week()), ("За месяц", data.month())):
+            progress_message += (
+                f"\n{title}: выпито {totals['water']} мл, "
+                f"потреблено {totals['calories_in']} ккал, сожжено {totals['calories_out']} ккал."
+            )
+
+        images = await get_progress_charts(user_id, data, goal_calories, goal_water)
+        if len(images) == 1:
+            logger.info("Для пользователя %s выведен один график: накопительная динамика за сегодня", user_id)
         else:
-            logger.info(f"Для пользователя {user_id} выведено два графика: накопительная динамика за последнюю дату {user_data[user_id].last_date} и суммарная динамика за все время")
+            logger.info("Для пользователя %s выведено два графика: накопительная динамика за сегодня и суммарная динамика за последние %s дней", user_id, HISTORY_DAYS)
 
         await message.answer(progress_message)
-        for f in img_files:
-            await bot.send_photo(message.chat.id, photo=types.FSInputFile(f))
-            os.remove(f)
+        photos = [types.BufferedInputFile(image, filename=filename) for filename, image in zip(["today_plot.png", "history_plot.png"], images)]
+        if len(photos) == 1:
+            await bot.send_photo(message.chat.id, photo=photos[0])
+        elif photos:
+            # Оба графика одним альбомом: один запрос к Bot API вместо двух
+            await bot.send_media_group(message.chat.id, media=[types.InputMediaPhoto(media=photo) for photo in photos])
     else:
-        logger.info(f"Для пользователя {user_id} визуализация недоступна: отсутствуют данные.")
+        logger.info("Для пользователя %s визуализация недоступна: отсутствуют данные.", user_id)
         await message.answer("На данный момент статистика прогресса недоступна. Логируйте свои действия, чтобы получить ответ.")
 
     return
 
 
+@dp.message(Command('stats'), lambda message: message.from_user.id in ADMIN_IDS)
+async def cmd_stats(message: types.Message):
+    logger.info("Администратор %s запросил статистику.", message.from_user.id)
+    await message.answer(metrics.format_stats())
+
+
 @dp.message()
 async def process_invalid_message(message: types.Message):
-    logger.info(f"Для пользователь {message.from_user.id} ввел сообщение {message.text} без привязки к какой-либо команде")
+    logger.info("Для пользователь %s ввел сообщение %s без привязки к какой-либо команде", message.from_user.id, message.text)
     await message.answer("Пожалуйста, используйте одну из указанных команд.")
     return
 
 
-async def main():
+async def prewarm():
+    try:
+        start = time.perf_counter()
+        await asyncio.to_thread(prewarm_llm)
+        await prewarm_charts()
+        logger.info("Клиент GigaChat и процессы графиков загружены за %.2f с", time.perf_counter() - start)
+    except Exception:
+        logger.exception("Не удалось заранее загрузить клиент GigaChat и процессы графиков")
+
+
+async def rollover():
+    # Суммы за день, неделю и месяц и так поддерживаются при каждой записи (utils.Rollup),
+    # а текущий день журнала -- всегда сегодняшний (UserData читает суммы по get_today()),
+    # поэтому в полночь остается начать новый день целей и убрать устаревшие записи кэшей
+    goal_engine.rollover()
+    yesterday = (datetime.date.today() - datetime.timedelta(days=1)).isoformat()
+    active = sum(1 for data in user_data.values() if data.last_date == yesterday)
+    pruned = food_info.prune() + workout_info.prune() + weather.temperatures.prune()
+    logger.info("Начат новый день: вчера записи вели %s пользователей, удалено %s устаревших записей кэшей", active, pruned)
+
+
+# Часы, между которыми для напоминаний равномерно распределяется дневная норма воды
+REMINDER_DAY_START, REMINDER_DAY_END = 8, 22
+
+
+async def send_reminders():
+    # Напоминание получают пользователи, которые вели записи сегодня или вчера
+    # и выпили меньше, чем положено к этому часу
+    now = datetime.datetime.now()
+    share = (now.hour + now.minute / 60 - REMINDER_DAY_START) / (REMINDER_DAY_END - REMINDER_DAY_START)
+    share = min(max(share, 0), 1)
+    today = now.date().isoformat()
+    yesterday = (now.date() - datetime.timedelta(days=1)).isoformat()
+
+    queued = 0
+    for user_id, goals in list(goal_engine.goals.items()):
+        data = user_data.get(user_id)
+        if data is None or data.last_date not in (today, yesterday):
+            continue
+        water = data["water"]
+        goal = goals.water
+        if water < goal * share:
+            queued += send_queue.put(user_id, f"💧 Не забывайте пить воду: сегодня выпито {water} из {goal} мл, осталось {goal - water} мл.")
+    logger.info("Поставлено в очередь напоминаний о воде: %s", queued)
+
+
+async def prewarm_caches():
+    # Пока пользователи молчат, заранее обновляем то, что иначе пришлось бы ждать в ответе:
+    # температуру в городах пользователей с автоматической нормой воды и калорийность
+    # продуктов в кэше GigaChat, срок которой истекает в ближайшие сутки
+    stale = set(weather.temperatures.expiring(PREWARM_INTERVAL * 2))
+    cities = [city for city in goal_engine.cities if city in stale or city not in weather.temperatures.items]
+    for city in cities[:PREWARM_BATCH]:
+        if not scheduler.is_idle():
+            return
+        try:
+            await weather.refresh_temp(city)
+        except Exception:
+            logger.exception("Не удалось заранее обновить температуру для города %s", city)
+
+    foods = food_info.expiring(86400, PREWARM_BATCH)
+    if foods and scheduler.is_idle() and not gigachat_breaker.is_open:
+        logger.info("Заранее обновляем калорийность продуктов: %s", foods)
+        await food_flight.do(tuple(sorted(foods)), lambda: fetch_calories_batch(food_info, foods))
+
+
+if ROLLOVER_TIME:
+    scheduler.daily("rollover", ROLLOVER_TIME, rollover)
+if REMINDER_TIMES:
+    scheduler.daily("reminders", REMINDER_TIMES, send_reminders)
+scheduler.every("prewarm_caches", PREWARM_INTERVAL, prewarm_caches, idle=True)
+for job in scheduler.jobs.values():
+    metrics.registry.register_stats("scheduler", job.name, job.stats)
+
+
+@dp.startup()
+async def on_startup():
+    food_info.load()
+    workout_info.load()
+    await storage.start()
+    await writer.start()
+    await weather.start()
+    await send_queue.start()
+    await scheduler.start()
     await set_commands()
-    await dp.start_polling(bot)
+    if PREWARM:
+        task = asyncio.create_task(prewarm())
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+
+@dp.shutdown()
+async def on_shutdown():
+    await scheduler.close()
+    await send_queue.close()
+    shutdown_charts()
+    await weather.close()
+    await writer.close()
+    await storage.close()
+    knowledge_store.close()
+
+
+async def main():
+    if BOT_MODE == "webhook":
+        app = create_app(
+            dp, bot, WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+            WEBHOOK_MAX_CONCURRENCY, WEBHOOK_MAX_PENDING, WEBHOOK_DRAIN_TIMEOUT,
+        )
+        metrics.registry.register_stats("webhook", "updates", app["webhook_handler"].stats)
+        metrics.add_routes(app, METRICS_PATH)
+        await serve(app, WEBHOOK_HOST, WEBHOOK_PORT)
+    else:
+        metrics_runner = None
+        if METRICS_PORT:
+            metrics_runner = await metrics.start_server(METRICS_HOST, METRICS_PORT, METRICS_PATH)
+        try:
+            await dp.start_polling(bot)
+        finally:
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,267 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+from logger import logger
+from collections import OrderedDict
+
+
+class KnowledgeStore(object):
+    """Хранилище справочных данных (калорийность продуктов и тренировок) в SQLite."""
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS knowledge ("
+            " kind TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " value TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (kind, key))"
+        )
+        self.conn.commit()
+
+    def load(self, kind, limit, min_updated_at=0):
+        rows = self.conn.execute(
+            "SELECT key, value, updated_at FROM knowledge"
+            " WHERE kind = ? AND updated_at >= ?"
+            " ORDER BY updated_at DESC LIMIT ?",
+            (kind, min_updated_at, limit),
+        ).fetchall()
+        return [(key, json.loads(value), updated_at) for key, value, updated_at in reversed(rows)]
+
+    def save(self, kind, key, value, updated_at):
+        # Запись происходит только после ответа GigaChat (секунды),
+        # поэтому одиночный upsert в WAL-режиме на этом фоне незаметен
+        self.conn.execute(
+            "INSERT OR REPLACE INTO knowledge (kind, key, value, updated_at) VALUES (?, ?, ?, ?)",
+            (kind, key, json.dumps(value), updated_at),
+        )
+        self.conn.commit()
+
+    def prune(self, kind, min_updated_at):
+        self.conn.execute("DELETE FROM knowledge WHERE kind = ? AND updated_at < ?", (kind, min_updated_at))
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+class KnowledgeCache(object):
+    """Ограниченный по размеру LRU-кэш с TTL и опциональным хранилищем на диске."""
+
+    def __init__(self, kind, max_size=10000, ttl=None, store=None, index=None):
+        self.kind = kind
+        self.max_size = max_size
+        self.ttl = ttl
+        self.store = store
+        self.index = index
+        self.items = OrderedDict()
+        self.hits = 0
+        self.fuzzy_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def _expired(self, stored_at, now):
+        return self.ttl is not None and now - stored_at > self.ttl
+
+    def load(self):
+        if self.store is None:
+            return 0
+
+        min_updated_at = 0
+        if self.ttl is not None:
+            min_updated_at = time.time() - self.ttl
+            self.store.prune(self.kind, min_updated_at)
+
+        for key, value, updated_at in self.store.load(self.kind, self.max_size, min_updated_at):
+            self.items[key] = (value, updated_at)
+            self.items.move_to_end(key)
+            if self.index is not None:
+                self.index.add(key)
+
+        logger.info("Кэш %s: загружено %s записей из %s", self.kind, len(self.items), self.store.path)
+        return len(self.items)
+
+    def _lookup(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+
+        value, stored_at = item
+        if self._expired(stored_at, time.time()):
+            self._discard(key)
+            return None
+
+        self.items.move_to_end(key)
+        return value
+
+    def _discard(self, key):
+        del self.items[key]
+        if self.index is not None:
+            self.index.remove(key)
+
+    def get(self, key):
+        value = self._lookup(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def find(self, key):
+        """Точное совпадение, а при его отсутствии -- ближайшее по индексу названий. Возвращает (ключ, значение) или None."""
+        value = self._lookup(key)
+        if value is None and self.index is not None:
+            match = self.index.match(key)
+            if match is not None:
+                value = self._lookup(match[0])
+                if value is not None:
+                    logger.info("Кэш %s: %s сопоставлено с %s (сходство %.2f)", self.kind, key, match[0], match[1])
+                    key = match[0]
+                    self.fuzzy_hits += 1
+
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return key, value
+
+    def set(self, key, value):
+        now = time.time()
+        self.items[key] = (value, now)
+        self.items.move_to_end(key)
+        if self.index is not None:
+            self.index.add(key)
+
+        while len(self.items) > self.max_size:
+            self._discard(next(iter(self.items)))
+            self.evictions += 1
+
+        if self.store is not None:
+            try:
+                self.store.save(self.kind, key, value, now)
+            except sqlite3.Error:
+                logger.exception("Не удалось сохранить запись %s кэша %s на диск", key, self.kind)
+
+    def expiring(self, within, limit=None):
+        """Ключи записей, срок которых истечет в ближайшие within секунд, начиная с самых старых."""
+        if self.ttl is None:
+            return []
+        deadline = time.time() - self.ttl + within
+        items = sorted((stored_at, key) for key, (_, stored_at) in self.items.items() if stored_at < deadline)
+        return [key for _, key in items[:limit]]
+
+    def prune(self):
+        """Удалить устаревшие записи из памяти и с диска. Возвращает число удаленных из памяти."""
+        if self.ttl is None:
+            return 0
+        now = time.time()
+        expired = [key for key, (_, stored_at) in self.items.items() if self._expired(stored_at, now)]
+        for key in expired:
+            self._discard(key)
+        if self.store is not None:
+            self.store.prune(self.kind, now - self.ttl)
+        return len(expired)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self.items),
+            "hits": self.hits,
+            "fuzzy_hits": self.fuzzy_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+class SingleFlight(object):
+    """Объединяет одновременные одинаковые запросы: выполняется один, остальные ждут его результат."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = {}
+        self.executed = 0
+        self.deduplicated = 0
+
+    async def do(self, key, fn):
+        task = self.calls.get(key)
+        if task is None:
+            self.executed += 1
+            task = asyncio.ensure_future(fn())
+            self.calls[key] = task
+            task.add_done_callback(lambda _: self.calls.pop(key, None))
+        else:
+            self.deduplicated += 1
+            logger.info("Запрос %s для %s уже выполняется, ожидаем его результат", self.name, key)
+
+        # shield: отмена одного из ожидающих не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    def stats(self):
+        return {
+            "in_flight": len(self.calls),
+            "executed": self.executed,
+            "deduplicated": self.deduplicated,
+        }
+
+
+class MemoryBoundedCache(object):
+    """LRU-кэш, ограниченный суммарным размером значений в байтах."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.items = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.items)
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+
+        self.items.move_to_end(key)
+        self.hits += 1
+        return item[0]
+
+    def set(self, key, value, size):
+        if size > self.max_bytes:
+            return
+
+        if key in self.items:
+            self.size -= self.items.pop(key)[1]
+        self.items[key] = (value, size)
+        self.size += size
+
+        while self.size > self.max_bytes:
+            _, (_, evicted_size) = self.items.popitem(last=False)
+            self.size -= evicted_size
+            self.evictions += 1
+
+    def stats(self):
+        return {
+            "size": len(self.items),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,167 @@
+import io
+import os
+import math
+import time
+import asyncio
+import numpy as np
+from utils import get_today
+from metrics import external_latency
+from concurrent.futures import ProcessPoolExecutor
+
+CHART_WORKERS = int(os.environ.get("CHART_WORKERS", 2))
+# Сколько последних дней показывает график суммарной динамики
+HISTORY_DAYS = int(os.environ.get("HISTORY_DAYS", 30))
+
+_executor = None
+
+
+def _load_plotting():
+    # matplotlib нужен только процессам пула: основной процесс его не импортирует,
+    # а каждый процесс пула загружает его один раз при старте (initializer)
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    return Figure, FigureCanvasAgg
+
+
+# Фигуры создаются один раз на процесс пула и перерисовываются для каждого запроса
+_figures = {}
+
+
+def _figure(name):
+    if name not in _figures:
+        Figure, FigureCanvasAgg = _load_plotting()
+        fig = Figure(figsize=(8, 4))
+        FigureCanvasAgg(fig)
+        ax1 = fig.add_subplot()
+        ax2 = ax1.twinx()
+        _figures[name] = fig, ax1, ax2
+
+    fig, ax1, ax2 = _figures[name]
+    ax1.cla()
+    ax2.cla()
+    # cla() сбрасывает настройки второй оси, которые выставляет twinx()
+    ax2.yaxis.tick_right()
+    ax2.yaxis.set_label_position("right")
+    ax2.yaxis.set_offset_position("right")
+    ax2.xaxis.set_visible(False)
+    ax2.patch.set_visible(False)
+    return fig, ax1, ax2
+
+
+def _to_png(fig):
+    # Поля заданы заранее (subplots_adjust): bbox_inches="tight" потребовал бы лишней отрисовки
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+
+# Цвета столбцов приглушены так же, как это делал seaborn (saturation=0.75)
+CALORIES_IN_COLOR = "#c32d4b"
+CALORIES_OUT_COLOR = "#701010"
+
+
+def _plot(fig, ax1, ax2, labels, calories_in, calories_out, water, cal_food_norm, water_norm, title):
+    x = np.arange(len(labels))
+    ax1.bar(x, calories_in, width=0.8, label="Потреблено ккал", color=CALORIES_IN_COLOR)
+    ax1.bar(x, calories_out, width=0.8, label="Сожжено ккал", color=CALORIES_OUT_COLOR)
+    ax1.axhline(cal_food_norm, color="red", label="Норма потребления в день", linestyle="--")
+    ax1.set_xticks(x, labels)
+    ax1.set_xlim(-0.5, len(labels) - 0.5)
+
+    ax2.plot(x, water, linewidth=3, label="Потреблено воды", color="royalblue")
+    ax2.axhline(water_norm, color="royalblue", label="Норма воды в день", linestyle="--", zorder=1)
+
+    ax1.set_ylabel("ккал", color="maroon")
+    ax2.set_ylabel("мл", color="navy")
+    ax1.tick_params(axis='y', labelcolor="maroon")
+    ax2.tick_params(axis='y', labelcolor="navy")
+
+    handles1, labels1 = ax1.get_legend_handles_labels()
+    handles2, labels2 = ax2.get_legend_handles_labels()
+    ax2.set_title(title)
+    ax2.legend(handles1 + handles2, labels1 + labels2)
+    return _to_png(fig)
+
+
+def draw_stat(today, history, date, cal_food_norm, water_norm, history_days=None):
+    """Рисует графики прогресса и возвращает их в виде PNG (bytes). Выполняется в процессе пула."""
+    if not today["water"]:
+        return []
+
+    # Накопительный график за сегодня
+    fig, ax1, ax2 = _figure("today")
+    fig.subplots_adjust(left=0.1, right=0.9, bottom=0.13, top=0.92)
+    ax1.set_xlabel("Номер записи в истории")
+    images = [_plot(
+        fig, ax1, ax2, [str(i) for i in range(len(today["water"]))],
+        np.cumsum(today["calories_in"]), np.cumsum(today["calories_out"]), np.cumsum(today["water"]),
+        cal_food_norm, water_norm, f"Накопительная динамика прогресса за сегодня ({date})",
+    )]
+
+    if len(history) > 1:
+        dates = list(history)
+        rotation = min(15 * (len(dates) // 6), 90)
+        fig, ax1, ax2 = _figure("history")
+        # Место под подписи дат растет вместе с углом их поворота
+        fig.subplots_adjust(left=0.1, right=0.9, bottom=0.13 + 0.23 * math.sin(math.radians(rotation)), top=0.92)
+        ax1.set_xlabel("Дата")
+        ax1.tick_params(axis='x', labelrotation=rotation)
+        images.append(_plot(
+            fig, ax1, ax2, dates,
+            [history[date]["calories_in"] for date in dates],
+            [history[date]["calories_out"] for date in dates],
+            [history[date]["water"] for date in dates],
+            cal_food_norm, water_norm,
+            f"Суммарная динамика прогресса за последние {history_days} дн." if history_days else "Суммарная динамика прогресса за все время",
+        ))
+
+    return images
+
+
+def _timed_draw_stat(*args):
+    # Время отрисовки измеряется в процессе пула и возвращается вместе с графиками:
+    # счетчики метрик живут в основном процессе
+    start = time.perf_counter()
+    images = draw_stat(*args)
+    return images, time.perf_counter() - start
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=CHART_WORKERS, initializer=_load_plotting)
+    return _executor
+
+
+def _ready():
+    return True
+
+
+async def prewarm():
+    """Запускает процессы пула заранее, чтобы первый /check_progress не ждал импорта библиотек."""
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    await asyncio.gather(*(loop.run_in_executor(executor, _ready) for _ in range(CHART_WORKERS)))
+
+
+async def render_stat(user_data, cal_food_norm, water_norm):
+    # В пул передаются только простые структуры, а не весь журнал пользователя;
+    # объем данных ограничен одним днем и окном в HISTORY_DAYS дней, сколько бы ни длилась история
+    date = get_today()
+    today = user_data[-1]
+    history = user_data.history(HISTORY_DAYS, date)
+    loop = asyncio.get_running_loop()
+    # render_stat включает ожидание свободного процесса, draw_stat -- только саму отрисовку
+    with external_latency.time("render_stat"):
+        images, elapsed = await loop.run_in_executor(
+            get_executor(), _timed_draw_stat, today, history, date, cal_food_norm, water_norm, HISTORY_DAYS
+        )
+    external_latency.observe("draw_stat", elapsed)
+    return images
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
@@ -0,0 +1,67 @@
+"""Фейковая модель GigaChat для локальной проверки бота без сети и ключа API.
+
+Включается переменной ``GIGACHAT_FAKE=1``. Отвечает на запросы калорийности правдоподобными
+детерминированными числами в том формате, который просит бот, а также умеет отвечать с
+задержкой, ошибкой или мусором, чтобы проверить повторы и размыкатель цепи в ``llm.py``::
+
+    GIGACHAT_FAKE=1 GIGACHAT_FAKE_LATENCY=0.5 GIGACHAT_FAKE_FAILURE_RATE=0.2 python bot.py
+"""
+import os
+import re
+import json
+import zlib
+import random
+import asyncio
+
+
+class FakeResponse(object):
+    def __init__(self, content):
+        self.content = content
+
+    def __repr__(self):
+        return f"FakeResponse(content={self.content!r})"
+
+
+class FakeGigaChat(object):
+    """Модель с методом ainvoke, как у langchain_gigachat.GigaChat."""
+
+    def __init__(self, latency=0.0, failure_rate=0.0, garbage_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.garbage_rate = garbage_rate
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            float(os.environ.get("GIGACHAT_FAKE_LATENCY", 0)),
+            float(os.environ.get("GIGACHAT_FAKE_FAILURE_RATE", 0)),
+            float(os.environ.get("GIGACHAT_FAKE_GARBAGE_RATE", 0)),
+        )
+
+    @staticmethod
+    def value(name, low, high):
+        # Одно и то же название всегда получает одно и то же число
+        return low + zlib.crc32(name.encode("utf-8")) % (high - low + 1)
+
+    def answer(self, prompt):
+        limits = (1, 15) if "сжигается" in prompt else (20, 600)
+        # Пакетный запрос из bot.fetch_calories_batch: "... каждого продукта из списка: a, b? ..."
+        batch = re.search(r"из списка: (.*?)\? ", prompt)
+        if batch is not None:
+            names = batch.group(1).split(", ")
+            return json.dumps({name: self.value(name, *limits) for name in names}, ensure_ascii=False)
+        subject = re.search(r"(?:граммах|минуту) (.*?)\?", prompt)
+        name = subject.group(1) if subject else prompt
+        return json.dumps({"value": self.value(name, *limits)})
+
+    async def ainvoke(self, messages):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.random.random() < self.failure_rate:
+            raise ConnectionError("Фейковый сбой GigaChat")
+        if self.random.random() < self.garbage_rate:
+            return FakeResponse("Не могу ответить на этот вопрос")
+        return FakeResponse(self.answer(messages[-1].content))
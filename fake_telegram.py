@@ -0,0 +1,144 @@
+"""Фейковый Telegram для локальной проверки бота в режиме вебхука.
+
+Поднимает фейковый Bot API, который принимает ответы бота, и отправляет синтетические
+обновления на вебхук. Пример (каждая команда в своем терминале)::
+
+    python fake_telegram.py --fake-api-port 8081 --serve
+    BOT_MODE=webhook BOT_TOKEN=123:fake TELEGRAM_API_URL=http://127.0.0.1:8081 python bot.py
+    python fake_telegram.py --url http://127.0.0.1:8080/webhook --users 50
+"""
+import time
+import asyncio
+import argparse
+import itertools
+from aiohttp import web, ClientSession
+from collections import Counter
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def _chat(chat_id):
+    return {"id": chat_id, "type": "private"}
+
+
+def message_update(update_id, user_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": _chat(user_id),
+            "from": _user(user_id),
+            "text": text,
+        },
+    }
+
+
+def callback_update(update_id, user_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": str(user_id),
+            "from": _user(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": _chat(user_id),
+                "from": _user(user_id),
+                "text": "",
+            },
+        },
+    }
+
+
+def create_fake_api():
+    """Bot API, отвечающий успехом на любой метод; счетчики вызовов лежат в app["calls"]."""
+    calls = Counter()
+    message_ids = itertools.count(1)
+
+    async def handle(request):
+        method = request.match_info["method"]
+        calls[method] += 1
+        data = await request.post()
+        if method.lower().startswith("send"):
+            message = {"message_id": next(message_ids), "date": int(time.time()), "chat": _chat(int(data.get("chat_id", 0)))}
+            result = [message] if method == "sendMediaGroup" else message
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    app = web.Application()
+    app["calls"] = calls
+    app.router.add_post("/bot{token}/{method}", handle)
+    return app
+
+
+async def inject(url, updates, secret=None, concurrency=10):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+    latencies = []
+    statuses = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(session, update):
+        async with semaphore:
+            start = time.perf_counter()
+            async with session.post(url, json=update, headers=headers) as response:
+                await response.read()
+                statuses[response.status] += 1
+            latencies.append(time.perf_counter() - start)
+
+    async with ClientSession() as session:
+        await asyncio.gather(*(send(session, update) for update in updates))
+    return latencies, statuses
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--text", action="append", help="текст сообщения, можно указать несколько раз")
+    parser.add_argument("--fake-api-port", type=int, help="поднять фейковый Bot API на этом порту")
+    parser.add_argument("--serve", action="store_true", help="только держать фейковый Bot API, ничего не отправляя")
+    parser.add_argument("--wait", type=float, default=2.0, help="сколько секунд ждать ответов бота")
+    args = parser.parse_args()
+    if args.serve and not args.fake_api_port:
+        parser.error("--serve требует --fake-api-port")
+
+    runner = None
+    if args.fake_api_port:
+        runner = web.AppRunner(create_fake_api())
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", args.fake_api_port).start()
+
+    if args.serve:
+        try:
+            await asyncio.Event().wait()
+        finally:
+            print(f"Вызовы Bot API: {dict(runner.app['calls'])}")
+            await runner.cleanup()
+
+    texts = args.text or ["/start", "/help", "/log_water 250"]
+    update_ids = itertools.count(1)
+    updates = [message_update(next(update_ids), 1000 + user, text) for user in range(args.users) for text in texts]
+
+    start = time.perf_counter()
+    latencies, statuses = await inject(args.url, updates, args.secret, args.concurrency)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    print(f"Отправлено обновлений: {len(updates)} за {elapsed:.2f} с ({len(updates) / elapsed:.0f}/с), статусы: {dict(statuses)}")
+    print(f"Задержка ответа вебхука: p50 {latencies[len(latencies) // 2] * 1000:.1f} мс, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} мс")
+
+    if runner is not None:
+        await asyncio.sleep(args.wait)
+        print(f"Вызовы Bot API: {dict(runner.app['calls'])}")
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
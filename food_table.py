@@ -0,0 +1,83 @@
+import os
+import csv
+import sys
+import numpy as np
+from logger import logger
+from names import NameIndex, normalize_name
+
+NAMES_FILE = "food_names.npy"
+KCAL_FILE = "food_kcal.npy"
+
+
+class FoodTable(object):
+    """Встроенная таблица калорийности (ккал на 100 г), хранящаяся по столбцам в .npy."""
+
+    def __init__(self, names, kcal, threshold=0.6):
+        # names отсортированы: точный поиск -- бинарный, в том числе для целого списка сразу
+        self.names = names
+        self.kcal = kcal
+        self.index = NameIndex(threshold)
+        for name in names:
+            self.index.add(str(name))
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def load(cls, directory, threshold=0.6):
+        try:
+            names = np.load(os.path.join(directory, NAMES_FILE), mmap_mode="r")
+            kcal = np.load(os.path.join(directory, KCAL_FILE), mmap_mode="r")
+        except FileNotFoundError:
+            logger.warning("Таблица калорийности не найдена в %s, используется пустая таблица", directory)
+            names, kcal = np.array([], dtype="U1"), np.array([], dtype=np.uint16)
+
+        logger.info("Загружена таблица калорийности: %s продуктов", len(names))
+        return cls(names, kcal, threshold)
+
+    def lookup_many(self, foods):
+        """Калорийность для списка названий за один векторизованный проход; NaN -- продукта нет в таблице."""
+        result = np.full(len(foods), np.nan)
+        if len(self.names) == 0 or len(foods) == 0:
+            return result
+
+        queries = np.array([normalize_name(food) for food in foods])
+        positions = np.searchsorted(self.names, queries).clip(max=len(self.names) - 1)
+        found = self.names[positions] == queries
+        result[found] = self.kcal[positions[found]]
+        return result
+
+    def find(self, food):
+        """Точное, а затем ближайшее по триграммам совпадение. Возвращает (название, ккал) или None."""
+        food = normalize_name(food)
+        kcal = self.lookup_many([food])[0]
+        if not np.isnan(kcal):
+            return food, int(kcal)
+        return self.match(food)
+
+    def match(self, food):
+        """Только ближайшее по триграммам совпадение (после промаха lookup_many). Возвращает (название, ккал) или None."""
+        match = self.index.match(normalize_name(food))
+        if match is None:
+            return None
+
+        position = np.searchsorted(self.names, match[0])
+        return match[0], int(self.kcal[position])
+
+
+def build(csv_path, directory):
+    with open(csv_path, encoding="utf-8") as f:
+        rows = {normalize_name(row["name"]): int(row["kcal"]) for row in csv.DictReader(f)}
+
+    names = sorted(rows)
+    width = max(len(name) for name in names)
+    np.save(os.path.join(directory, NAMES_FILE), np.array(names, dtype=f"U{width}"))
+    np.save(os.path.join(directory, KCAL_FILE), np.array([rows[name] for name in names], dtype=np.uint16))
+    return len(names)
+
+
+if __name__ == "__main__":
+    # Пересборка таблицы после правки CSV: python food_table.py [data/foods.csv] [data]
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else "data/foods.csv"
+    directory = sys.argv[2] if len(sys.argv) > 2 else os.path.dirname(csv_path)
+    print(f"Записано продуктов: {build(csv_path, directory)}")
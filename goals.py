@@ -0,0 +1,197 @@
+import time
+from logger import logger
+from utils import get_today
+from names import normalize_name
+from collections import OrderedDict
+
+# Жара, при которой норма воды увеличивается, и надбавки к норме воды
+HEAT_TEMPERATURE = 25
+HEAT_WATER = 500
+WORKOUT_WATER = 200  # мл за каждые 30 минут тренировки
+
+
+def base_water(weight, is_male, activity):
+    return weight * 30 + 500 * is_male + (activity // 30) * 500
+
+
+def heat_water(temperature):
+    return HEAT_WATER * (temperature is not None and temperature >= HEAT_TEMPERATURE)
+
+
+def workout_water(duration):
+    return (duration // 30) * WORKOUT_WATER
+
+
+def base_calories(sex, weight, height, age, cpa):
+    # На основе формулы Харриса-Бенедикта (добавлен КФА)
+    if sex == "мужской":
+        return int((66.5 + 13.75 * weight + 5.003 * height - 6.775 * age) * cpa)
+    return int((655.1 + 9.563 * weight + 1.85 * height - 4.676 * age) * 0.9 * cpa)
+
+
+class Goals(object):
+    """Дневные цели пользователя: норма воды складывается из базовой части профиля,
+    надбавки за жару в его городе и надбавки за сегодняшние тренировки."""
+    __slots__ = ("profile", "calories", "base_water", "heat_water", "workout_water", "day", "city")
+
+    def __init__(self, profile, calories, base_water, heat_water=0, city=None):
+        # Профиль, из которого рассчитаны цели: по нему видно, что цели пора пересчитать
+        self.profile = profile
+        self.calories = calories
+        self.base_water = base_water
+        self.heat_water = heat_water
+        self.workout_water = 0
+        self.day = get_today()
+        # Город, если норма воды рассчитана автоматически и зависит от погоды
+        self.city = city
+
+    def _rollover(self):
+        today = get_today()
+        if self.day != today:
+            self.day = today
+            self.workout_water = 0
+
+    @property
+    def water(self):
+        self._rollover()
+        return self.base_water + self.heat_water + self.workout_water
+
+
+class GoalEngine(object):
+    """Кэш дневных целей пользователей, рассчитанных из профиля один раз.
+
+    Цели обновляются на месте: при записи тренировки и при изменении температуры
+    в городе пользователя, поэтому обработчики команд не обращаются к погоде, а с хранилищем
+    в памяти процесса -- и к профилю. Температура города обновляется в фоне через refresh(city),
+    не чаще раза в temp_ttl секунд; результат приходит в update_temperature.
+
+    Надбавка за тренировки хранится в storage. Если хранилище общее для нескольких процессов
+    (storage.shared), профиль и надбавка читаются из него при каждом обращении,
+    а цели пересчитываются, только если профиль изменился.
+    """
+
+    def __init__(self, storage, refresh=None, temp_ttl=1800, max_users=100000):
+        self.storage = storage
+        self.refresh = refresh
+        self.temp_ttl = temp_ttl
+        self.max_users = max_users
+        self.goals = OrderedDict()
+        # Город -> [пользователи с автоматической нормой воды, температура, время последнего обновления]
+        self.cities = {}
+        self.hits = 0
+        self.misses = 0
+
+    def set_profile(self, user_id, profile):
+        """Пересчитать цели по новому профилю (после /set_profile)."""
+        old = self.goals.get(user_id)
+        goals = self._build(user_id, profile)
+        if old is not None and goals is not None:
+            goals.day, goals.workout_water = old.day, old.workout_water
+        return goals
+
+    async def get(self, user_id):
+        goals = self.goals.get(user_id)
+        if goals is None or self.storage.shared:
+            goals = await self._load(user_id)
+        else:
+            self.hits += 1
+            self.goals.move_to_end(user_id)
+
+        if goals is not None and goals.city is not None:
+            self._refresh_if_stale(goals.city)
+        return goals
+
+    async def _load(self, user_id):
+        date = get_today()
+        profile = await self.storage.get_profile(user_id)
+        workout = await self.storage.get_workout_water(user_id, date)
+        # Пока шла загрузка, цели мог рассчитать параллельный запрос того же пользователя
+        goals = self.goals.get(user_id)
+        if goals is not None and goals.profile == profile:
+            self.hits += 1
+            self.goals.move_to_end(user_id)
+        else:
+            self.misses += 1
+            goals = self._build(user_id, profile)
+        if goals is not None:
+            goals.day, goals.workout_water = date, workout
+        return goals
+
+    async def add_workout(self, user_id, duration):
+        """Добавить к сегодняшней норме воды надбавку за тренировку. Возвращает надбавку и цели."""
+        extra = workout_water(duration)
+        goals = await self.get(user_id)
+        if goals is not None:
+            date = get_today()
+            goals.day, goals.workout_water = date, await self.storage.add_workout_water(user_id, date, extra)
+        return extra, goals
+
+    def rollover(self):
+        """Начать новый день для всех целей сразу: сбросить надбавки за вчерашние тренировки."""
+        for goals in self.goals.values():
+            goals._rollover()
+
+    def update_temperature(self, city, temperature):
+        city = normalize_name(city)
+        entry = self.cities.get(city)
+        if entry is None:
+            return
+        entry[1:] = [temperature, time.monotonic()]
+        heat = heat_water(temperature)
+        changed = 0
+        for user_id in entry[0]:
+            goals = self.goals[user_id]
+            if goals.heat_water != heat:
+                goals.heat_water = heat
+                changed += 1
+        if changed:
+            logger.info("Температура в городе %s: %s градусов, норма воды пересчитана для %s пользователей", city, temperature, changed)
+
+    def _build(self, user_id, profile):
+        self._discard(user_id)
+        if profile is None:
+            return None
+
+        city = None
+        if profile.get("water_auto"):
+            city = normalize_name(profile["city"])
+            water = profile["water_base"]
+            entry = self.cities.setdefault(city, [set(), None, 0.0])
+            entry[0].add(user_id)
+            # Пока температура города неизвестна, действует надбавка на момент настройки профиля
+            heat = profile["water"] - water if entry[1] is None else heat_water(entry[1])
+        else:
+            # Норма указана вручную или профиль сохранен до появления автоматического пересчета
+            water = profile["water"]
+            heat = 0
+
+        goals = self.goals[user_id] = Goals(profile, profile["calories"], water, heat, city)
+        while len(self.goals) > self.max_users:
+            self._discard(next(iter(self.goals)))
+        return goals
+
+    def _discard(self, user_id):
+        goals = self.goals.pop(user_id, None)
+        if goals is not None and goals.city is not None:
+            users = self.cities[goals.city][0]
+            users.discard(user_id)
+            if not users:
+                del self.cities[goals.city]
+
+    def _refresh_if_stale(self, city):
+        entry = self.cities[city]
+        now = time.monotonic()
+        if self.refresh is not None and now - entry[2] > self.temp_ttl:
+            # Отмечаем сразу, чтобы следующие запросы не запускали обновление повторно
+            entry[2] = now
+            self.refresh(city)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self.goals),
+            "cities": len(self.cities),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
@@ -0,0 +1,310 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+from logger import logger
+from dotenv import load_dotenv
+from metrics import registry, timed
+from names import normalize_name
+
+load_dotenv()
+
+# Ограничения на обращения к GigaChat: число одновременных запросов,
+# длина очереди ожидающих и таймаут одного запроса (в секундах)
+GIGACHAT_MAX_CONCURRENCY = int(os.environ.get("GIGACHAT_MAX_CONCURRENCY", 4))
+GIGACHAT_MAX_PENDING = int(os.environ.get("GIGACHAT_MAX_PENDING", 32))
+GIGACHAT_TIMEOUT = float(os.environ.get("GIGACHAT_TIMEOUT", 30))
+# Повторы неудачных запросов: число попыток и экспоненциальная пауза между ними со случайным разбросом
+GIGACHAT_RETRIES = int(os.environ.get("GIGACHAT_RETRIES", 3))
+GIGACHAT_BACKOFF = float(os.environ.get("GIGACHAT_BACKOFF", 0.5))
+GIGACHAT_BACKOFF_MAX = float(os.environ.get("GIGACHAT_BACKOFF_MAX", 5))
+# После GIGACHAT_BREAKER_THRESHOLD неудач подряд запросы сразу отклоняются в течение GIGACHAT_BREAKER_RESET секунд
+GIGACHAT_BREAKER_THRESHOLD = int(os.environ.get("GIGACHAT_BREAKER_THRESHOLD", 5))
+GIGACHAT_BREAKER_RESET = float(os.environ.get("GIGACHAT_BREAKER_RESET", 30))
+# Локальная фейковая модель вместо GigaChat (см. fake_gigachat.py)
+GIGACHAT_FAKE = os.environ.get("GIGACHAT_FAKE", "0") == "1"
+
+_chat = None
+
+
+def get_chat():
+    # langchain и клиент GigaChat загружаются при первом запросе (или в prewarm), а не при запуске бота
+    global _chat
+    if _chat is None:
+        if GIGACHAT_FAKE:
+            from fake_gigachat import FakeGigaChat
+            _chat = FakeGigaChat.from_env()
+        else:
+            from langchain_gigachat import GigaChat
+            _chat = GigaChat(credentials=os.environ.get("API_TOKEN"), verify_ssl_certs=False)
+    return _chat
+
+
+def make_messages(prompt):
+    from langchain_core.messages import SystemMessage
+    return [SystemMessage(content=prompt)]
+
+
+class GigaChatOverloaded(Exception):
+    pass
+
+
+class InvalidResponse(ValueError):
+    pass
+
+
+class GigaChatPool(object):
+    """Асинхронный вызов GigaChat с ограничением числа запросов в полете.
+
+    Если model не задана, используется общий клиент из get_chat().
+    """
+
+    def __init__(self, model, max_concurrency, max_pending, timeout):
+        self._model = model
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @property
+    def model(self):
+        if self._model is None:
+            self._model = get_chat()
+        return self._model
+
+    async def invoke(self, messages):
+        # Если очередь уже переполнена, отказываем сразу, а не копим ожидающих
+        if self.waiting >= self.max_pending:
+            raise GigaChatOverloaded(f"Превышен лимит ожидающих запросов к GigaChat: {self.max_pending}")
+
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+        try:
+            return await asyncio.wait_for(self.model.ainvoke(messages), timeout=self.timeout)
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self):
+        return {"in_flight": self.in_flight, "waiting": self.waiting}
+
+
+class CircuitBreaker(object):
+    """Размыкатель цепи для обращений к GigaChat.
+
+    После threshold неудачных обращений подряд цепь размыкается: в течение reset_timeout секунд
+    запросы отклоняются сразу, не тратя время пользователя на заведомо неудачные попытки.
+    Затем пропускается один пробный запрос: при успехе цепь замыкается, при неудаче снова размыкается.
+    Исход запросов, начатых до размыкания и завершившихся, пока цепь разомкнута, на нее не влияет:
+    состояние разомкнутой цепи меняет только пробный запрос (trial=True в success и failure).
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.opens = 0
+        self.rejected = 0
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        if self.opened_at is None:
+            return True
+        if not self.trial and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.trial = True
+            return True
+        self.rejected += 1
+        return False
+
+    def success(self, trial=False):
+        if self.opened_at is not None and not trial:
+            return
+        if trial:
+            logger.info("Связь с GigaChat восстановлена")
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def release(self):
+        # Пробный запрос завершился без ответа и без ошибки GigaChat (переполнение очереди, отмена):
+        # цепь остается разомкнутой, но следующий запрос снова может стать пробным
+        self.trial = False
+
+    def failure(self, trial=False):
+        if self.opened_at is not None and not trial:
+            return
+        self.failures += 1
+        if trial or self.failures >= self.threshold:
+            logger.warning("GigaChat недоступен после %s неудач подряд, запросы отклоняются %s с", self.failures, self.reset_timeout)
+            self.opened_at = time.monotonic()
+            self.opens += 1
+        self.trial = False
+
+    def stats(self):
+        return {"open": int(self.is_open), "failures": self.failures, "opens": self.opens, "rejected": self.rejected}
+
+
+def prewarm():
+    get_chat()
+    make_messages("")
+
+
+pool = GigaChatPool(None, GIGACHAT_MAX_CONCURRENCY, GIGACHAT_MAX_PENDING, GIGACHAT_TIMEOUT)
+breaker = CircuitBreaker(GIGACHAT_BREAKER_THRESHOLD, GIGACHAT_BREAKER_RESET)
+errors = registry.counter("gigachat_errors_total", "Неудачные обращения к GigaChat по причинам", "reason")
+
+NUMBER = r"\d+(?:[.,]\d+)?"
+
+
+def _parse_json(content):
+    # Модель иногда оборачивает JSON в текст или блок кода: берем первый объект или массив
+    return json.loads(re.search(r"\{.*\}|\[.*\]", content, re.S).group(0))
+
+
+def _to_number(value):
+    """52, 52.5, "52,5 ккал" или диапазон "50-60" (берется середина); все прочее -- InvalidResponse."""
+    if isinstance(value, bool):
+        raise InvalidResponse(f"Ожидалось число, получено {value!r}")
+    if isinstance(value, (int, float)):
+        return float(value)
+
+    text = str(value)
+    numbers = [float(number.replace(",", ".")) for number in re.findall(NUMBER, text)]
+    if len(numbers) == 1:
+        return numbers[0]
+    if len(numbers) == 2 and re.search(rf"{NUMBER}\s*(?:-|–|—|до)\s*{NUMBER}", text):
+        return sum(numbers) / 2
+    raise InvalidResponse(f"Не удалось однозначно выделить число из {text!r}")
+
+
+def _checked(number, low, high):
+    if not low <= number <= high:
+        raise InvalidResponse(f"Значение {number} вне допустимого диапазона [{low}, {high}]")
+    number = round(number, 1)
+    return int(number) if number.is_integer() else number
+
+
+def parse_value(content, low, high):
+    """Число из ответа вида {"value": 52} или просто 52 с проверкой правдоподобия."""
+    try:
+        data = _parse_json(content)
+    except (AttributeError, ValueError):
+        data = content
+    value = data.get("value") if isinstance(data, dict) else data
+    return _checked(_to_number(value), low, high)
+
+
+def parse_values(content, names, low, high):
+    """{название: число} из JSON-объекта с ответом по каждому названию из names.
+
+    Значения вне диапазона и неизвестные названия отбрасываются. Если модель изменила
+    названия, но сохранила их число и порядок, ответ сопоставляется по позиции.
+    """
+    data = _parse_json(content)
+    if not isinstance(data, dict):
+        raise InvalidResponse(f"Ожидался JSON-объект, получено {data!r}")
+
+    values = {}
+    for position, (name, value) in enumerate(data.items()):
+        name = normalize_name(name)
+        if name not in names and len(data) == len(names):
+            name = names[position]
+        if name in names:
+            try:
+                values[name] = _checked(_to_number(value), low, high)
+            except InvalidResponse as e:
+                logger.warning("Отброшено значение для %s: %s", name, e)
+    if not values:
+        raise InvalidResponse(f"В ответе нет допустимых значений для {names}")
+    return values
+
+
+def _backoff(attempt):
+    # Экспоненциальная пауза с полным случайным разбросом, чтобы повторы разных запросов не совпадали
+    return random.uniform(0, min(GIGACHAT_BACKOFF_MAX, GIGACHAT_BACKOFF * 2 ** attempt))
+
+
+async def _ask(prompt, parse):
+    """Результат parse(ответ) или строка с описанием ошибки.
+
+    Таймауты, ошибки и непригодные ответы повторяются до GIGACHAT_RETRIES раз с паузой.
+    При переполненной очереди или разомкнутой цепи ошибка возвращается сразу.
+    """
+    if not breaker.allow():
+        errors.inc("circuit_open")
+        return "GigaChat временно недоступен, попробуйте позже"
+    # Этот запрос -- пробный после размыкания цепи (allow() только что выставил trial)
+    trial = breaker.trial
+
+    try:
+        error_message = None
+        for attempt in range(GIGACHAT_RETRIES):
+            if attempt:
+                await asyncio.sleep(_backoff(attempt - 1))
+
+            response = None
+            try:
+                logger.info("Запрос к GigaChat: %s", prompt)
+                response = await pool.invoke(make_messages(prompt))
+                logger.info("Ответ от GigaChat: %s", response)
+
+            except GigaChatOverloaded as e:
+                errors.inc("overloaded")
+                logger.warning("%s", e)
+                return str(e)
+
+            except asyncio.TimeoutError:
+                errors.inc("timeout")
+                error_message = f"Превышено время ожидания ответа GigaChat ({pool.timeout} с)"
+                logger.warning(error_message)
+                breaker.failure(trial)
+                trial = False
+
+            except Exception:
+                errors.inc("error")
+                error_message = "Ошибка при запросе GigaChat"
+                logger.exception(error_message)
+                breaker.failure(trial)
+                trial = False
+
+            else:
+                breaker.success(trial)
+                trial = False
+                try:
+                    return parse(response.content)
+                except (InvalidResponse, ValueError, AttributeError) as e:
+                    errors.inc("invalid")
+                    error_message = f"Непригодный ответ GigaChat:\n- {response.content}"
+                    logger.warning("Непригодный ответ GigaChat (%s): %s", e, response.content)
+
+            if breaker.is_open:
+                break
+        return error_message
+    finally:
+        if trial:
+            breaker.release()
+
+
+@timed("gigachat_call")
+async def gigachat_call(prompt, low, high):
+    """Число из диапазона [low, high] по ответу GigaChat или строка с описанием ошибки."""
+    return await _ask(prompt, lambda content: parse_value(content, low, high))
+
+
+@timed("gigachat_batch_call")
+async def gigachat_batch_call(prompt, names, low, high):
+    """{название: число} для тех names, на которые GigaChat дал допустимый ответ, или строка с описанием ошибки."""
+    return await _ask(prompt, lambda content: parse_values(content, names, low, high))
@@ -1,13 +1,60 @@
+import os
+import json
+import queue
+import atexit
 import logging
+from dotenv import load_dotenv
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+load_dotenv()
+
+LOG_FILE = os.environ.get("LOG_FILE", "logs.log")
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "DEBUG")
+# "text" (по умолчанию) или "json" -- по одному JSON-объекту на строку
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "text")
+LOG_ENCODING = os.environ.get("LOG_ENCODING", "cp1251")
+LOG_MAX_MB = float(os.environ.get("LOG_MAX_MB", 10))
+LOG_BACKUP_COUNT = int(os.environ.get("LOG_BACKUP_COUNT", 5))
+LOG_CONSOLE = os.environ.get("LOG_CONSOLE", "0") == "1"
+
+
+class JsonFormatter(logging.Formatter):
+    # Трассировка исключения уже добавлена в message: QueueHandler форматирует запись перед отправкой в очередь
+    def format(self, record):
+        payload = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        return json.dumps(payload, ensure_ascii=False)
 
 
 logger = logging.getLogger('logger')
-logger.setLevel(logging.DEBUG)
+logger.setLevel(LOG_LEVEL)
 
-console_handler = logging.StreamHandler()
-file_handler = logging.FileHandler('logs.log', 'w', 'cp1251')
+if LOG_FORMAT == "json":
+    formatter = JsonFormatter()
+else:
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
 
-formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+# Запись на диск выполняет отдельный поток QueueListener, а обработчики бота
+# только кладут записи в очередь. Сообщения передаются с аргументами (logger.info("... %s", x)),
+# поэтому строка собирается лишь для записей, прошедших проверку уровня
+file_handler = RotatingFileHandler(
+    LOG_FILE, 'a', maxBytes=int(LOG_MAX_MB * 1024 * 1024), backupCount=LOG_BACKUP_COUNT,
+    encoding=LOG_ENCODING, errors='replace',
+)
 file_handler.setFormatter(formatter)
+handlers = [file_handler]
+
+if LOG_CONSOLE:
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(formatter)
+    handlers.append(console_handler)
+
+log_queue = queue.SimpleQueue()
+logger.addHandler(QueueHandler(log_queue))
 
-logger.addHandler(file_handler)
+listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+listener.start()
+atexit.register(listener.stop)
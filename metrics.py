@@ -0,0 +1,229 @@
+import time
+import bisect
+from aiohttp import web
+from logger import logger
+from aiogram import BaseMiddleware
+
+# Границы корзин гистограмм задержки в секундах
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram(object):
+    """Гистограмма задержек в формате Prometheus с одной меткой (например, имя обработчика)."""
+
+    def __init__(self, name, description, label, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = tuple(buckets)
+        # значение метки -> [счетчики по корзинам (последняя -- +Inf), сумма, число наблюдений]
+        self.series = {}
+
+    def observe(self, value, seconds):
+        series = self.series.get(value)
+        if series is None:
+            series = self.series[value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, seconds)] += 1
+        series[1] += seconds
+        series[2] += 1
+
+    def time(self, value):
+        return _Timer(self, value)
+
+    def quantile(self, value, q):
+        """Оценка квантиля сверху: граница корзины, в которую он попадает."""
+        counts, _, count = self.series[value]
+        rank = q * count
+        seen = 0
+        for bound, bucket in zip(self.buckets, counts):
+            seen += bucket
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for value, (counts, total, count) in sorted(self.series.items()):
+            label = f'{self.label}="{_escape(value)}"'
+            seen = 0
+            for bound, bucket in zip(self.buckets, counts):
+                seen += bucket
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {seen}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{label}}} {total}")
+            lines.append(f"{self.name}_count{{{label}}} {count}")
+        return lines
+
+
+class Counter(object):
+    def __init__(self, name, description, label):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.series = {}
+
+    def inc(self, value, amount=1):
+        self.series[value] = self.series.get(value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for value, count in sorted(self.series.items()):
+            lines.append(f'{self.name}{{{self.label}="{_escape(value)}"}} {count}')
+        return lines
+
+
+class _Timer(object):
+    def __init__(self, histogram, value):
+        self.histogram = histogram
+        self.value = value
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(self.value, time.perf_counter() - self.start)
+        return False
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Registry(object):
+    """Метрики процесса: гистограммы, счетчики и показатели, которые считываются
+    из методов stats() кэшей, очередей и т.п. в момент запроса /metrics."""
+
+    def __init__(self, prefix="bot"):
+        self.prefix = prefix
+        self.metrics = []
+        self.collectors = []
+
+    def histogram(self, name, description, label, buckets=DEFAULT_BUCKETS):
+        metric = Histogram(f"{self.prefix}_{name}", description, label, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, description, label):
+        metric = Counter(f"{self.prefix}_{name}", description, label)
+        self.metrics.append(metric)
+        return metric
+
+    def register_stats(self, group, name, stats):
+        # stats -- функция без аргументов, возвращающая словарь числовых показателей
+        self.collectors.append((group, name, stats))
+
+    def collect(self):
+        result = {}
+        for group, name, stats in self.collectors:
+            try:
+                values = stats()
+            except Exception:
+                logger.exception("Не удалось собрать показатели %s/%s", group, name)
+                continue
+            result.setdefault(group, {})[name] = values
+        return result
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for group, values_by_name in self.collect().items():
+            fields = {}
+            for name, values in values_by_name.items():
+                for field, value in values.items():
+                    if isinstance(value, (int, float)):
+                        fields.setdefault(field, []).append((name, value))
+            for field, series in fields.items():
+                metric_name = f"{self.prefix}_{group}_{field}"
+                lines.append(f"# TYPE {metric_name} gauge")
+                for name, value in series:
+                    lines.append(f'{metric_name}{{name="{_escape(name)}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+handler_latency = registry.histogram(
+    "handler_duration_seconds", "Время обработки обновления обработчиком", "handler"
+)
+handler_errors = registry.counter(
+    "handler_errors_total", "Число обработчиков, завершившихся исключением", "handler"
+)
+external_latency = registry.histogram(
+    "external_call_duration_seconds", "Время обращения к внешним сервисам и тяжелым вычислениям", "call"
+)
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: измеряет время каждого обработчика по имени его функции."""
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        with handler_latency.time(name):
+            try:
+                return await handler(event, data)
+            except Exception:
+                handler_errors.inc(name)
+                raise
+
+
+def timed(call):
+    """Декоратор асинхронной функции: записывает ее время в external_latency под именем call."""
+
+    def decorator(fn):
+        async def wrapper(*args, **kwargs):
+            with external_latency.time(call):
+                return await fn(*args, **kwargs)
+
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        return wrapper
+
+    return decorator
+
+
+async def handle_metrics(request):
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+
+def add_routes(app, path="/metrics"):
+    app.router.add_get(path, handle_metrics)
+
+
+async def start_server(host, port, path="/metrics"):
+    """Отдельный HTTP-сервер для /metrics (в режиме polling, где нет сервера вебхука)."""
+    app = web.Application()
+    add_routes(app, path)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info("Метрики доступны на %s:%s%s", host, port, path)
+    return runner
+
+
+def format_stats():
+    """Краткая сводка для команды /stats."""
+    lines = ["Обработчики (число, среднее, p95):"]
+    for name, (_, total, count) in sorted(handler_latency.series.items()):
+        errors = handler_errors.series.get(name, 0)
+        line = f"- {name}: {count}, {total / count * 1000:.0f} мс, ≤{handler_latency.quantile(name, 0.95) * 1000:.0f} мс"
+        lines.append(line + (f", ошибок: {errors}" if errors else ""))
+
+    lines.append("\nВнешние вызовы (число, среднее, p95):")
+    for name, (_, total, count) in sorted(external_latency.series.items()):
+        lines.append(f"- {name}: {count}, {total / count * 1000:.0f} мс, ≤{external_latency.quantile(name, 0.95) * 1000:.0f} мс")
+
+    for metric in registry.metrics:
+        if isinstance(metric, Counter) and metric is not handler_errors and metric.series:
+            shown = ", ".join(f"{value}={count}" for value, count in sorted(metric.series.items()))
+            lines.append(f"\n{metric.description}: {shown}")
+
+    for group, values_by_name in registry.collect().items():
+        lines.append(f"\n{group}:")
+        for name, values in values_by_name.items():
+            shown = ", ".join(
+                f"{field}={value:.3g}" if isinstance(value, float) else f"{field}={value}"
+                for field, value in values.items()
+            )
+            lines.append(f"- {name}: {shown}")
+    return "\n".join(lines)
@@ -0,0 +1,113 @@
+import re
+import os
+from collections import defaultdict
+
+NON_WORD = re.compile(r"[\W_]+")
+
+
+def normalize_name(text):
+    # Без лемматизации: регистр, ё -> е, пунктуация и лишние пробелы
+    text = text.lower().replace("ё", "е")
+    return NON_WORD.sub(" ", text).strip()
+
+
+def trigrams(name):
+    padded = f" {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def dice(a, b):
+    return 2 * len(a & b) / (len(a) + len(b)) if a or b else 0.0
+
+
+def head(name):
+    return name.split(" ", 1)[0]
+
+
+def tail(name):
+    return name.split(" ")[1:]
+
+
+def same_word(a, b):
+    # Одно слово с другим окончанием или опечаткой в конце ("вареный" и "вареная"),
+    # но не разные слова с общим окончанием ("вареная" и "жареная")
+    length = min(len(a), len(b))
+    return len(os.path.commonprefix([a, b])) >= max(length - 2, min(length, 3))
+
+
+def compatible(a, b):
+    """Уточнения после первого слова не противоречат друг другу: каждое слово более короткого
+    есть и в другом. Общее название без уточнений совместимо с любым уточненным."""
+    if len(a) > len(b):
+        a, b = b, a
+    return all(any(same_word(x, y) for y in b) for x in a)
+
+
+class NameIndex(object):
+    """Триграммный индекс названий для поиска ближайшего совпадения."""
+
+    def __init__(self, threshold=0.6):
+        self.threshold = threshold
+        self.postings = defaultdict(set)
+        self.grams = {}
+        self.heads = {}
+        self.tails = {}
+
+    def __len__(self):
+        return len(self.grams)
+
+    def __contains__(self, key):
+        return key in self.grams
+
+    def add(self, key):
+        if key in self.grams:
+            return
+        name = normalize_name(key)
+        grams = trigrams(name)
+        self.grams[key] = grams
+        self.heads[key] = trigrams(head(name))
+        self.tails[key] = tail(name)
+        for gram in grams:
+            self.postings[gram].add(key)
+
+    def remove(self, key):
+        grams = self.grams.pop(key, None)
+        if grams is None:
+            return
+        del self.heads[key]
+        del self.tails[key]
+        for gram in grams:
+            keys = self.postings[gram]
+            keys.discard(key)
+            if not keys:
+                del self.postings[gram]
+
+    def match(self, name):
+        """Возвращает (ключ, сходство) ближайшего названия или None, если сходство ниже порога."""
+        name = normalize_name(name)
+        if not name:
+            return None
+        query = trigrams(name)
+
+        shared = defaultdict(int)
+        for gram in query:
+            for key in self.postings.get(gram, ()):
+                shared[key] += 1
+
+        # Первое слово обычно главное ("масло сливочное"): без его совпадения
+        # общие прилагательные дают ложные пары вроде "рис вареный" -> "яйцо вареный".
+        # Остальные слова уточняют продукт, и разные уточнения -- разные продукты:
+        # "курица жареная" похожа на "курица вареная" по триграммам, но не должна с ней совпасть
+        query_head = trigrams(head(name))
+        query_tail = tail(name)
+        best_key, best_score = None, self.threshold
+        for key, count in shared.items():
+            # Коэффициент Дайса по множествам триграмм
+            score = 2 * count / (len(query) + len(self.grams[key]))
+            if (score >= best_score and dice(query_head, self.heads[key]) >= self.threshold
+                    and compatible(query_tail, self.tails[key])):
+                best_key, best_score = key, score
+
+        if best_key is None:
+            return None
+        return best_key, best_score
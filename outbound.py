@@ -0,0 +1,131 @@
+import time
+import asyncio
+from logger import logger
+from throttling import TokenBuckets
+from aiogram.exceptions import TelegramAPIError, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+# Методы Bot API, которые отправляют сообщение в чат и подпадают под лимиты Telegram
+LIMITED_METHODS = ("Send", "Forward", "Copy")
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    """Middleware сессии бота: ограничивает отправку сообщений лимитами Telegram.
+
+    Каждое сообщение ждет токен в корзине своего чата (chat_rate в секунду, до chat_burst подряд),
+    а затем в общей корзине бота (rate в секунду). Токены выдаются по очереди, поэтому всплеск
+    ответов растягивается во времени, а не превращается в ошибки 429. Если Telegram все же отвечает
+    RetryAfter, чат не получает токенов указанное время, и запрос повторяется до retries раз.
+    """
+
+    def __init__(self, rate=30.0, chat_rate=1.0, chat_burst=3, retries=3, max_chats=100000):
+        self.bot_bucket = TokenBuckets(rate, 1.0)
+        self.chat_buckets = TokenBuckets(chat_burst, chat_burst / chat_rate, max_chats)
+        self.retries = retries
+        self.sent = 0
+        self.delayed = 0
+        self.delay_seconds = 0.0
+        self.retry_after = 0
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not type(method).__name__.startswith(LIMITED_METHODS):
+            return await make_request(bot, method)
+
+        for attempt in range(self.retries + 1):
+            await self._acquire(chat_id)
+            try:
+                response = await make_request(bot, method)
+                self.sent += 1
+                return response
+            except TelegramRetryAfter as e:
+                self.retry_after += 1
+                if attempt == self.retries:
+                    raise
+                logger.warning("Telegram ограничил отправку %s в чат %s на %s с", type(method).__name__, chat_id, e.retry_after)
+                self.chat_buckets.delay(chat_id, time.monotonic(), e.retry_after)
+
+    async def _acquire(self, chat_id):
+        wait = self.chat_buckets.reserve(chat_id, time.monotonic())
+        if wait > 0:
+            await asyncio.sleep(wait)
+        # Токен бота берется, когда чат уже дождался своей очереди, иначе он простаивал бы зря
+        bot_wait = self.bot_bucket.reserve(None, time.monotonic())
+        if bot_wait > 0:
+            await asyncio.sleep(bot_wait)
+        if wait > 0 or bot_wait > 0:
+            self.delayed += 1
+            self.delay_seconds += wait + bot_wait
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "delayed": self.delayed,
+            "delay_seconds": self.delay_seconds,
+            "retry_after": self.retry_after,
+            "chats": len(self.chat_buckets.buckets),
+        }
+
+
+class SendQueue(object):
+    """Очередь фоновых сообщений (напоминания и т.п.), которые не ждет ни один пользователь.
+
+    Сообщения отправляет один воркер не чаще rate в секунду -- с запасом до общего лимита
+    OutboundLimiter, чтобы массовая рассылка не отнимала его у ответов на команды.
+    Повторы после RetryAfter выполняет OutboundLimiter.
+    """
+
+    def __init__(self, bot, rate=10.0, max_size=100000):
+        self.bot = bot
+        self.buckets = TokenBuckets(rate, 1.0)
+        self.queue = asyncio.Queue(max_size)
+        self.task = None
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def put(self, chat_id, text):
+        try:
+            self.queue.put_nowait((chat_id, text))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        if self.queue.qsize():
+            logger.info("Очередь отправки остановлена, не отправлено %s сообщений", self.queue.qsize())
+
+    async def _run(self):
+        while True:
+            chat_id, text = await self.queue.get()
+            wait = self.buckets.reserve(None, time.monotonic())
+            if wait > 0:
+                await asyncio.sleep(wait)
+            await self._send(chat_id, text)
+
+    async def _send(self, chat_id, text):
+        try:
+            await self.bot.send_message(chat_id, text)
+            self.sent += 1
+        except TelegramForbiddenError:
+            # Пользователь заблокировал бота
+            self.failed += 1
+        except TelegramAPIError:
+            self.failed += 1
+            logger.exception("Не удалось отправить сообщение в чат %s", chat_id)
+
+    def stats(self):
+        return {
+            "depth": self.queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "dropped": self.dropped,
+        }
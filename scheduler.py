@@ -0,0 +1,125 @@
+import time
+import asyncio
+import datetime
+from logger import logger
+from aiogram import BaseMiddleware
+from metrics import external_latency
+
+
+def parse_times(spec):
+    """'0:00,13:30' -> [time(0, 0), time(13, 30)]."""
+    times = []
+    for item in spec.split(","):
+        if item.strip():
+            hour, _, minute = item.strip().partition(":")
+            times.append(datetime.time(int(hour), int(minute or 0)))
+    return times
+
+
+def seconds_until(times, now=None):
+    """Сколько секунд до ближайшего из моментов суток times (по местному времени)."""
+    now = now or datetime.datetime.now()
+    delays = []
+    for at in times:
+        target = datetime.datetime.combine(now.date(), at)
+        if target <= now:
+            target += datetime.timedelta(days=1)
+        delays.append((target - now).total_seconds())
+    return min(delays)
+
+
+class Job(object):
+    def __init__(self, name, fn, next_delay, idle=False):
+        self.name = name
+        self.fn = fn
+        # Функция без аргументов: через сколько секунд запускать задачу в следующий раз
+        self.next_delay = next_delay
+        self.idle = idle
+        self.runs = 0
+        self.skipped = 0
+        self.failures = 0
+        self.last_duration = 0.0
+
+    def stats(self):
+        return {
+            "runs": self.runs,
+            "skipped": self.skipped,
+            "failures": self.failures,
+            "last_duration": self.last_duration,
+        }
+
+
+class Scheduler(object):
+    """Периодические задачи внутри процесса бота, каждая в своей asyncio-задаче.
+
+    Задачи с idle=True запускаются, только если бот не получал обновлений idle_after секунд,
+    чтобы фоновая работа не конкурировала с ответами пользователям; иначе пропускают запуск.
+    Время выполнения задач пишется в external_latency под именем job_<имя задачи>.
+    """
+
+    def __init__(self, idle_after=60.0):
+        self.idle_after = idle_after
+        self.jobs = {}
+        self.tasks = []
+        self.last_activity = time.monotonic()
+
+    def daily(self, name, times, fn, idle=False):
+        """Запускать fn каждый день в моменты суток times."""
+        # Запас в секунду: sleep по монотонным часам может закончиться чуть раньше момента по настенным
+        self.jobs[name] = Job(name, fn, lambda: seconds_until(times) + 1, idle)
+
+    def every(self, name, interval, fn, idle=False):
+        """Запускать fn каждые interval секунд."""
+        self.jobs[name] = Job(name, fn, lambda: interval, idle)
+
+    def touch(self):
+        self.last_activity = time.monotonic()
+
+    def is_idle(self):
+        return time.monotonic() - self.last_activity >= self.idle_after
+
+    async def start(self):
+        self.tasks = [asyncio.create_task(self._loop(job)) for job in self.jobs.values()]
+
+    async def close(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def _loop(self, job):
+        while True:
+            try:
+                delay = job.next_delay()
+            except Exception:
+                # Без расписания задача больше не запустится: это должно быть видно в журнале
+                logger.exception("Не удалось рассчитать время следующего запуска фоновой задачи %s, задача остановлена", job.name)
+                return
+            await asyncio.sleep(delay)
+            if job.idle and not self.is_idle():
+                job.skipped += 1
+                continue
+            await self.run(job.name)
+
+    async def run(self, name):
+        job = self.jobs[name]
+        start = time.perf_counter()
+        try:
+            with external_latency.time(f"job_{name}"):
+                await job.fn()
+        except Exception:
+            job.failures += 1
+            logger.exception("Фоновая задача %s завершилась с ошибкой", name)
+        job.runs += 1
+        job.last_duration = time.perf_counter() - start
+
+
+class ActivityMiddleware(BaseMiddleware):
+    """Внешний middleware: отмечает в планировщике время последнего обновления от пользователей."""
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+
+    async def __call__(self, handler, event, data):
+        self.scheduler.touch()
+        return await handler(event, data)
@@ -0,0 +1,328 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import aiosqlite
+from logger import logger
+from abc import ABC, abstractmethod
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+
+class Storage(ABC):
+    """Хранилище профилей, журналов UserData и состояний FSM.
+
+    События журнала передаются кортежами (user_id, время, номер дня, вид, значение).
+
+    Если хранилище общее для нескольких процессов (shared), журналы, загруженные в процесс,
+    нужно сверять с ним при каждом обращении: обновления одного пользователя могут
+    обрабатывать разные процессы.
+    """
+
+    fsm: BaseStorage
+    shared = False
+
+    async def start(self):
+        pass
+
+    @abstractmethod
+    async def get_profile(self, user_id):
+        pass
+
+    @abstractmethod
+    async def set_profile(self, user_id, profile):
+        pass
+
+    @abstractmethod
+    async def get_workout_water(self, user_id, date):
+        pass
+
+    @abstractmethod
+    async def add_workout_water(self, user_id, date, amount):
+        """Прибавить к надбавке за тренировки за дату date (ISO). Возвращает новую надбавку."""
+        pass
+
+    @abstractmethod
+    async def append_events(self, events):
+        pass
+
+    @abstractmethod
+    async def load_events(self, user_id, position=None):
+        """События пользователя, записанные другими процессами после позиции position,
+        и новая позиция для следующего вызова. Без position -- весь журнал."""
+        pass
+
+    async def close(self):
+        await self.fsm.close()
+
+
+class InMemoryStorage(Storage):
+    # Все хранится в памяти процесса и теряется при перезапуске.
+    # Журналы и так живут в UserData, поэтому здесь они не дублируются
+
+    def __init__(self):
+        self.fsm = MemoryStorage()
+        self.profiles = {}
+        # Пользователь -> (дата, надбавка к норме воды за тренировки): хранится только последний день
+        self.workout_water = {}
+
+    async def get_profile(self, user_id):
+        return self.profiles.get(user_id)
+
+    async def set_profile(self, user_id, profile):
+        self.profiles[user_id] = dict(profile)
+
+    async def get_workout_water(self, user_id, date):
+        day, water = self.workout_water.get(user_id, (None, 0))
+        return water if day == date else 0
+
+    async def add_workout_water(self, user_id, date, amount):
+        water = await self.get_workout_water(user_id, date) + amount
+        self.workout_water[user_id] = (date, water)
+        return water
+
+    async def append_events(self, events):
+        pass
+
+    async def load_events(self, user_id, position=None):
+        return 0, []
+
+
+class SQLiteStorage(Storage):
+    """SQLite в режиме WAL с одним переиспользуемым соединением на процесс.
+
+    Несколько процессов на одном хосте могут работать с одним файлом базы. Каждое событие
+    помечается процессом, который его записал (origin), а позицией в журнале служит rowid:
+    так процесс дочитывает только чужие события, которых у него еще нет.
+    """
+
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = None
+        self.fsm = SQLiteFSMStorage(self)
+        self.origin = uuid.uuid4().hex
+
+    async def start(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.conn = await aiosqlite.connect(self.path)
+        await self.conn.execute("PRAGMA journal_mode=WAL")
+        await self.conn.execute("PRAGMA synchronous=NORMAL")
+        await self.conn.execute("PRAGMA busy_timeout=5000")
+        await self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS profiles (user_id INTEGER PRIMARY KEY, profile TEXT NOT NULL)"
+        )
+        await self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS workout_water ("
+            " user_id INTEGER NOT NULL,"
+            " date TEXT NOT NULL,"
+            " water INTEGER NOT NULL,"
+            " PRIMARY KEY (user_id, date))"
+        )
+        await self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS events ("
+            " user_id INTEGER NOT NULL,"
+            " time REAL NOT NULL,"
+            " day INTEGER NOT NULL,"
+            " kind INTEGER NOT NULL,"
+            " value REAL NOT NULL,"
+            " origin TEXT NOT NULL)"
+        )
+        # rowid неявно входит в индекс последним столбцом: поиск по user_id и rowid > ? идет по индексу
+        await self.conn.execute("CREATE INDEX IF NOT EXISTS events_user_id ON events (user_id)")
+        await self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}')"
+        )
+        await self.conn.commit()
+        logger.info("Хранилище SQLite открыто: %s", self.path)
+
+    async def get_profile(self, user_id):
+        async with self.conn.execute("SELECT profile FROM profiles WHERE user_id = ?", (user_id,)) as cursor:
+            row = await cursor.fetchone()
+        return None if row is None else json.loads(row[0])
+
+    async def set_profile(self, user_id, profile):
+        await self.conn.execute(
+            "INSERT OR REPLACE INTO profiles (user_id, profile) VALUES (?, ?)",
+            (user_id, json.dumps(profile, ensure_ascii=False)),
+        )
+        await self.conn.commit()
+
+    async def get_workout_water(self, user_id, date):
+        async with self.conn.execute(
+            "SELECT water FROM workout_water WHERE user_id = ? AND date = ?", (user_id, date)
+        ) as cursor:
+            row = await cursor.fetchone()
+        return 0 if row is None else row[0]
+
+    async def add_workout_water(self, user_id, date, amount):
+        # Прибавление в самой базе: одновременные тренировки в разных процессах не теряются
+        await self.conn.execute(
+            "INSERT INTO workout_water (user_id, date, water) VALUES (?, ?, ?)"
+            " ON CONFLICT(user_id, date) DO UPDATE SET water = water + excluded.water",
+            (user_id, date, amount),
+        )
+        await self.conn.commit()
+        return await self.get_workout_water(user_id, date)
+
+    async def append_events(self, events):
+        if not events:
+            return
+        # Пачка событий -- одна транзакция
+        await self.conn.executemany(
+            "INSERT INTO events (user_id, time, day, kind, value, origin) VALUES (?, ?, ?, ?, ?, ?)",
+            [(*event, self.origin) for event in events],
+        )
+        await self.conn.commit()
+
+    async def load_events(self, user_id, position=None):
+        async with self.conn.execute(
+            "SELECT rowid, time, day, kind, value, origin FROM events WHERE user_id = ? AND rowid > ? ORDER BY rowid",
+            (user_id, position or 0),
+        ) as cursor:
+            rows = await cursor.fetchall()
+        events = [tuple(row[1:5]) for row in rows if position is None or row[5] != self.origin]
+        return (rows[-1][0] if rows else position or 0), events
+
+    async def close(self):
+        if self.conn is not None:
+            await self.conn.close()
+            self.conn = None
+
+
+class SQLiteFSMStorage(BaseStorage):
+    # Состояния FSM в той же базе и через то же соединение, что и SQLiteStorage
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        conn = self.storage.conn
+        await conn.execute(
+            "INSERT INTO fsm (key, state) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET state = excluded.state",
+            (self.key_builder.build(key), state),
+        )
+        await conn.commit()
+
+    async def get_state(self, key):
+        async with self.storage.conn.execute("SELECT state FROM fsm WHERE key = ?", (self.key_builder.build(key),)) as cursor:
+            row = await cursor.fetchone()
+        return None if row is None else row[0]
+
+    async def set_data(self, key, data):
+        conn = self.storage.conn
+        await conn.execute(
+            "INSERT INTO fsm (key, data) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+            (self.key_builder.build(key), json.dumps(data, ensure_ascii=False)),
+        )
+        await conn.commit()
+
+    async def get_data(self, key):
+        async with self.storage.conn.execute("SELECT data FROM fsm WHERE key = ?", (self.key_builder.build(key),)) as cursor:
+            row = await cursor.fetchone()
+        return {} if row is None else json.loads(row[0])
+
+    async def close(self):
+        # Соединение закрывает SQLiteStorage
+        pass
+
+
+class WriteBehindQueue(object):
+    """Копит события журнала и пишет их в хранилище пачками: по размеру или раз в interval секунд."""
+
+    def __init__(self, storage, batch_size=500, interval=1.0):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.interval = interval
+        self.pending = []
+        self.task = None
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self.flushes = 0
+        self.flushed_events = 0
+        self.failed_flushes = 0
+        self.last_flush_latency = 0.0
+        self.max_flush_latency = 0.0
+        self.total_flush_latency = 0.0
+
+    @property
+    def depth(self):
+        return len(self.pending)
+
+    def put(self, events):
+        self.pending.extend(events)
+        if len(self.pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def start(self):
+        self.task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self.pending:
+                return
+
+            batch, self.pending = self.pending, []
+            start = time.perf_counter()
+            try:
+                await self.storage.append_events(batch)
+            except Exception:
+                # Пачка возвращается в начало очереди и будет записана при следующей попытке
+                self.pending[:0] = batch
+                self.failed_flushes += 1
+                logger.exception("Не удалось записать %s событий, в очереди %s", len(batch), len(self.pending))
+                return
+
+            latency = time.perf_counter() - start
+            self.flushes += 1
+            self.flushed_events += len(batch)
+            self.last_flush_latency = latency
+            self.max_flush_latency = max(self.max_flush_latency, latency)
+            self.total_flush_latency += latency
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            "depth": self.depth,
+            "flushes": self.flushes,
+            "flushed_events": self.flushed_events,
+            "failed_flushes": self.failed_flushes,
+            "last_flush_latency": self.last_flush_latency,
+            "max_flush_latency": self.max_flush_latency,
+            "avg_flush_latency": self.total_flush_latency / self.flushes if self.flushes else 0.0,
+        }
+
+
+def create_storage(url):
+    # "memory" (по умолчанию) или "sqlite:///путь/к/файлу.sqlite3"
+    if not url or url == "memory":
+        return InMemoryStorage()
+    if url.startswith("sqlite:///"):
+        return SQLiteStorage(url[len("sqlite:///"):])
+    raise ValueError(f"Неизвестный тип хранилища: {url}")
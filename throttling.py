@@ -0,0 +1,125 @@
+import time
+from logger import logger
+from metrics import registry
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+from collections import OrderedDict
+
+throttled = registry.counter("throttled_total", "Отклоненные из-за превышения лимита обновления", "command")
+
+
+def parse_limits(spec):
+    """'default=30,log_food=6' -> {'default': 30, 'log_food': 6} (запросов в минуту)."""
+    limits = {}
+    for item in spec.split(","):
+        if item.strip():
+            name, limit = item.split("=")
+            limits[name.strip().lstrip("/")] = float(limit)
+    return limits
+
+
+class TokenBuckets(object):
+    """Корзины токенов по ключу: в среднем limit запросов за period секунд и не больше limit подряд.
+
+    Хранится не больше max_size корзин; вытесняются давно не использованные,
+    которые к этому моменту обычно уже снова полны.
+    """
+
+    def __init__(self, limit, period=60.0, max_size=100000):
+        self.capacity = limit
+        self.rate = limit / period
+        self.max_size = max_size
+        self.buckets = OrderedDict()
+
+    def _level(self, key, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            return self.capacity
+        tokens, updated = bucket
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def wait_time(self, key, now):
+        """Через сколько секунд появится токен (0, если он есть уже сейчас)."""
+        level = self._level(key, now)
+        return 0.0 if level >= 1 else (1 - level) / self.rate
+
+    def take(self, key, now):
+        self.buckets[key] = [self._level(key, now) - 1, now]
+        self.buckets.move_to_end(key)
+        if len(self.buckets) > self.max_size:
+            self.buckets.popitem(last=False)
+
+    def reserve(self, key, now):
+        """Занять токен, даже если его еще нет; возвращает, через сколько секунд он появится.
+
+        Уровень корзины уходит в минус, и следующий запрос с тем же ключом встает в очередь за этим.
+        """
+        wait = self.wait_time(key, now)
+        self.take(key, now)
+        return wait
+
+    def delay(self, key, now, seconds):
+        """Не выдавать токенов по ключу ближайшие seconds секунд."""
+        self.buckets[key] = [min(self._level(key, now), 1 - seconds * self.rate), now]
+        self.buckets.move_to_end(key)
+
+
+def _command(event):
+    if isinstance(event, Message) and event.text and event.text.startswith("/"):
+        return event.text.split(maxsplit=1)[0][1:].split("@")[0].lower()
+    return None
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Внешний middleware: ограничивает частоту обновлений от каждого пользователя.
+
+    Общий лимит limits["default"] действует на все сообщения и нажатия кнопок пользователя,
+    отдельные лимиты -- на дорогие команды (обращения к GigaChat, отрисовка графиков).
+    Лимит задается числом запросов в минуту. Сверх лимита обновление не обрабатывается,
+    а пользователь получает короткий ответ -- не чаще одного раза, пока лимит не восстановится.
+    """
+
+    def __init__(self, limits, exempt=(), period=60.0, max_users=100000):
+        limits = dict(limits)
+        self.default = TokenBuckets(limits.pop("default", 30), period, max_users)
+        self.commands = {command: TokenBuckets(limit, period, max_users) for command, limit in limits.items()}
+        self.exempt = set(exempt)
+        self.max_users = max_users
+        # Пользователь -> момент, до которого ему уже сообщили о превышении лимита
+        self.notified = OrderedDict()
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or user.id in self.exempt:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        command = _command(event)
+        buckets = [self.default]
+        if command in self.commands:
+            buckets.append(self.commands[command])
+
+        wait = max(bucket.wait_time(user.id, now) for bucket in buckets)
+        if wait > 0:
+            # Метка метрики -- только команда с отдельным лимитом: текст команды задает пользователь,
+            # и произвольные /команды иначе заводили бы новые серии метрики без ограничения
+            throttled.inc(command if command in self.commands else "other")
+            logger.info("Пользователь %s превысил лимит запросов (%s), повтор через %.0f с", user.id, command, wait)
+            await self._notify(event, user.id, wait, now)
+            return None
+
+        for bucket in buckets:
+            bucket.take(user.id, now)
+        return await handler(event, data)
+
+    async def _notify(self, event, user_id, wait, now):
+        if self.notified.get(user_id, 0) > now:
+            if not isinstance(event, Message):
+                await event.answer()
+            return
+
+        self.notified[user_id] = now + wait
+        self.notified.move_to_end(user_id)
+        if len(self.notified) > self.max_users:
+            self.notified.popitem(last=False)
+        await event.answer(f"Слишком много запросов. Попробуйте снова через {max(1, round(wait))} с.")
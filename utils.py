@@ -1,43 +1,95 @@
-import os
-import re
-import aiohttp
+import time
 import datetime
-import pandas as pd
-import seaborn as sns
+from array import array
 from typing import Union
-from logger import logger
-from dotenv import load_dotenv
-import matplotlib.pyplot as plt
-from collections import defaultdict
 
-from langchain_gigachat import GigaChat
-from langchain.schema import SystemMessage
 
-load_dotenv()
+def get_today():
+    return datetime.date.today().strftime("%Y-%m-%d")
 
-chat = GigaChat(credentials=os.environ.get("API_TOKEN"), verify_ssl_certs=False)
 
+KEYS = ("water", "calories_in", "calories_out")
+# Сумма за день хранится блоком: значения по KEYS, версия дня и позиции (+1) первого
+# и последнего события дня в журнале
+VERSION = len(KEYS)
+FIRST = VERSION + 1
+LAST = VERSION + 2
+STRIDE = len(KEYS) + 3
 
-def get_today():
-    return datetime.date.today().strftime("%Y-%m-%d")
+
+def _number(value):
+    return int(value) if value.is_integer() else value
+
+
+def _ordinal(date):
+    return datetime.date.fromisoformat(date).toordinal()
+
+
+def _week(day):
+    # Номер дня понедельника той же недели (день 1 по toordinal() -- понедельник)
+    return day - (day - 1) % 7
+
+
+def _month(day):
+    date = datetime.date.fromordinal(day)
+    return date.year * 12 + date.month - 1
+
+
+class Rollup(object):
+    """Суммы по KEYS за период (день, неделя или месяц), обновляемые при каждой записи.
+
+    Период -> смещение блока из stride значений в плоском массиве totals.
+    """
+    __slots__ = ("slots", "totals", "stride")
+
+    def __init__(self, stride=len(KEYS)):
+        self.slots = {}
+        self.totals = array("d")
+        self.stride = stride
+
+    def __len__(self):
+        return len(self.slots)
+
+    def slot(self, period):
+        slot = self.slots.get(period)
+        if slot is None:
+            slot = self.slots[period] = len(self.totals)
+            self.totals.extend([0.0] * self.stride)
+        return slot
+
+    def add(self, period, index, val):
+        self.totals[self.slot(period) + index] += val
+
+    def get(self, period, index):
+        slot = self.slots.get(period)
+        return 0 if slot is None else _number(self.totals[slot + index])
+
+    def row(self, period):
+        slot = self.slots.get(period)
+        if slot is None:
+            return None
+        return {key: _number(self.totals[slot + i]) for i, key in enumerate(KEYS)}
 
 
 class UserData(object):
+    __slots__ = ("times", "days", "kinds", "values", "next_events", "daily", "weekly", "monthly", "history_version", "last_date")
+
     def __init__(self):
-        self.data = defaultdict(
-            lambda: {
-                "water": [],
-                "calories_in": [],
-                "calories_out": [],
-            }
-        )
-        self.sum_data = defaultdict(
-            lambda: {
-                "water": 0,
-                "calories_in": 0,
-                "calories_out": 0,
-            }
-        )
+        # Журнал событий (время, номер дня, вид, значение) в типизированных массивах,
+        # без заполнения нулями: пишется только то, что пользователь действительно указал
+        self.times = array("d")
+        self.days = array("I")
+        self.kinds = array("B")
+        self.values = array("d")
+        # События одного дня связаны в список: позиция следующего события того же дня (+1, 0 -- конец),
+        # чтобы записи дня находились без просмотра всего журнала
+        self.next_events = array("I")
+        # Суммы за день, неделю и месяц поддерживаются при каждой записи. У дня есть еще и версия,
+        # которая растет с каждой записью: по ней кэшируются уже нарисованные графики
+        self.daily = Rollup(STRIDE)
+        self.weekly = Rollup()
+        self.monthly = Rollup()
+        self.history_version = 0
         self.last_date = None
 
     def append(self, d: dict, date=None):
@@ -45,114 +97,116 @@ class UserData(object):
         if date is None:
             date = self.last_date
 
-        for key in ["water", "calories_in", "calories_out"]:
-            val = d.get(key, 0)
-            self.data[date][key].append(val)
-            self.sum_data[date][key] += val
+        day = _ordinal(date)
+        now = time.time()
+        events = [(now, day, kind, d[key]) for kind, key in enumerate(KEYS) if key in d]
+        for event in events:
+            self._add(*event)
+
+        self.daily.add(day, VERSION, 1)
+        self.history_version += 1
+        # Новые события возвращаются, чтобы их можно было сохранить в хранилище
+        return events
+
+    def _add(self, event_time, day, kind, val):
+        position = len(self.kinds) + 1
+        slot = self.daily.slot(day)
+        last = int(self.daily.totals[slot + LAST])
+        if last:
+            self.next_events[last - 1] = position
+        else:
+            self.daily.totals[slot + FIRST] = position
+        self.daily.totals[slot + LAST] = position
+        self.next_events.append(0)
+
+        self.times.append(event_time)
+        self.days.append(day)
+        self.kinds.append(kind)
+        self.values.append(val)
+        self.daily.add(day, kind, val)
+        self.weekly.add(_week(day), kind, val)
+        self.monthly.add(_month(day), kind, val)
+
+    def restore(self, events):
+        # Восстановление журнала из хранилища: события (время, номер дня, вид, значение)
+        for event_time, day, kind, val in events:
+            self._add(event_time, day, kind, val)
+            self.daily.add(day, VERSION, 1)
+            self.history_version += 1
+
+        if len(self.days):
+            self.last_date = datetime.date.fromordinal(max(self.days)).isoformat()
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def _total(self, date, index):
+        if date is None:
+            return 0
+        return self.daily.get(_ordinal(date), index)
+
+    def version(self):
+        today = get_today()
+        return today, self._total(today, VERSION), self.history_version
+
+    def day_records(self, date):
+        # Записи дня в прежнем виде: по списку на каждый ключ, по строке на каждую запись
+        records = {key: [] for key in KEYS}
+        if date is None:
+            return records
+
+        slot = self.daily.slots.get(_ordinal(date))
+        position = 0 if slot is None else int(self.daily.totals[slot + FIRST])
+        while position:
+            kind = self.kinds[position - 1]
+            val = _number(self.values[position - 1])
+            for j, key in enumerate(KEYS):
+                records[key].append(val if j == kind else 0)
+            position = self.next_events[position - 1]
+        return records
+
+    def history(self, days=None, date=None):
+        """Суммы по дням {дата: {ключ: сумма}} за последние days дней до date включительно
+        (по умолчанию до сегодняшнего дня; все дни, если days не задан).
+
+        Окно ограничено датами, а не числом дней с записями:
+
+        >>> data = UserData()
+        >>> data.restore([(0, _ordinal("2025-10-18"), 0, 250), (0, _ordinal("2026-10-17"), 0, 500), (0, _ordinal("2026-10-18"), 0, 300)])
+        >>> list(data.history(30, "2026-10-19"))
+        ['2026-10-17', '2026-10-18']
+        >>> list(data.history())
+        ['2025-10-18', '2026-10-17', '2026-10-18']
+        """
+        if days is None:
+            periods = sorted(self.daily.slots)
+        else:
+            end = _ordinal(date or get_today())
+            start = end - days + 1
+            if len(self.daily) <= days:
+                # Дней с записями меньше, чем дней в окне: дешевле отфильтровать их, чем перебирать окно
+                periods = [day for day in sorted(self.daily.slots) if start <= day <= end]
+            else:
+                periods = [day for day in range(start, end + 1) if day in self.daily.slots]
+        return {datetime.date.fromordinal(day).isoformat(): self.daily.row(day) for day in periods}
+
+    def week(self, date=None):
+        """Суммы за неделю (с понедельника), в которую входит date (по умолчанию сегодня)."""
+        period = _week(_ordinal(date or get_today()))
+        return self.weekly.row(period) or dict.fromkeys(KEYS, 0)
+
+    def month(self, date=None):
+        """Суммы за календарный месяц, в который входит date (по умолчанию сегодня)."""
+        period = _month(_ordinal(date or get_today()))
+        return self.monthly.row(period) or dict.fromkeys(KEYS, 0)
 
     def __getitem__(self, key: Union[int, str]):
+        # Текущий день -- сегодняшний, а не день последней записи: после полуночи
+        # пользователь, который еще ничего не записал, видит нули
         if key == -1:
-            return self.data[self.last_date]
-        elif key in ["water", "calories_in", "calories_out"]:
-            return self.sum_data[self.last_date][key]
+            return self.day_records(get_today())
+        elif key in KEYS:
+            return self._total(get_today(), KEYS.index(key))
         else: # можно будет удалить
             assert isinstance(key, str)
-            return self.data[key]
-
-    def draw_stat(self, cal_food_norm, water_norm):
-        last_df_cs = pd.DataFrame.from_dict(self[-1]).cumsum()
-        if last_df_cs.shape[0] == 0:
-            return []
-
-        sum_df = pd.DataFrame.from_dict(self.sum_data).T.rename_axis("date").reset_index()
-        os.makedirs("img", exist_ok=True)
-
-        # Накопительный график за последний день
-        fig, ax1 = plt.subplots(figsize=(8, 4))
-        sns.barplot(last_df_cs["calories_in"], ax=ax1, label="Потреблено ккал", color="crimson")
-        sns.barplot(last_df_cs["calories_out"], ax=ax1, label="Сожжено ккал", color="maroon")
-        ax1.axhline(cal_food_norm, color="red", label="Норма потребления в день", linestyle="--")
-        ax1.set_xlabel("Номер записи в истории")
-
-        ax2 = ax1.twinx()
-        sns.lineplot(last_df_cs["water"], ax=ax2, linewidth=3, label="Потреблено воды", color="royalblue")
-        ax2.axhline(water_norm, color="royalblue", label="Норма воды в день", linestyle="--", zorder=1)
-
-        ax1.set_ylabel("ккал", color="maroon")
-        ax2.set_ylabel("мл", color="navy")
-        ax1.tick_params(axis='y', labelcolor="maroon")
-        ax2.tick_params(axis='y', labelcolor="navy")
-
-        lines_labels = [ax.get_legend_handles_labels() for ax in fig.axes]
-        lines, labels = [sum(lol, []) for lol in zip(*lines_labels)]
-        plt.title(f"Накопительная динамика прогресса за сегодня ({self.last_date})")
-        plt.legend(lines, labels)
-
-        plt.savefig("img/today_plot.png", bbox_inches="tight")
-        files = ["img/today_plot.png"]
-
-        if len(sum_df["date"]) > 1:
-            fig, ax1 = plt.subplots(figsize=(8, 4))
-            sns.barplot(sum_df, x="date", y="calories_in", ax=ax1, label="Потреблено ккал", color="crimson")
-            sns.barplot(sum_df, x="date", y="calories_out", ax=ax1, label="Сожжено ккал", color="maroon")
-            ax1.axhline(cal_food_norm, color="red", label="Норма потребления в день", linestyle="--")
-            ax1.set_xlabel("Дата")
-            ax1.tick_params(axis='x', labelrotation=15 * (len(sum_df["date"]) // 6))
-
-            ax2 = ax1.twinx()
-            sns.lineplot(sum_df, x="date", y="water", ax=ax2, linewidth=3, label="Потреблено воды", color="royalblue")
-            ax2.axhline(water_norm, color="royalblue", label="Норма воды в день", linestyle="--", zorder=1)
-
-            ax1.set_ylabel("ккал", color="maroon")
-            ax2.set_ylabel("мл", color="navy")
-            ax1.tick_params(axis='y', labelcolor="maroon")
-            ax2.tick_params(axis='y', labelcolor="navy")
-
-            lines_labels = [ax.get_legend_handles_labels() for ax in fig.axes]
-            lines, labels = [sum(lol, []) for lol in zip(*lines_labels)]
-            plt.title(f"Суммарная динамика прогресса за все время")
-            plt.legend(lines, labels)
-
-            plt.savefig("img/history_plot.png", bbox_inches="tight")
-            files.append("img/history_plot.png")
-
-        return files
-
-
-async def gigachat_call(prompt):
-    try:
-        logger.info(f"Запрос к GigaChat: {prompt}")
-        messages = [SystemMessage(content=prompt)]
-        response = chat.invoke(messages)
-        logger.info(f"Ответ от GigaChat: {response}")
-
-        calories = re.search(r"(\d+)", response.content).group(1)
-        return int(calories)
-
-    except Exception as e:
-        error_message = f"Ошибка при запросе GigaChat. Получен ответ:\n- {response}"
-        logger.exception(error_message)
-        return error_message
-
-
-async def get_temp(city):
-    logger.info(f"Расчет температуры для города: {city}")
-    api_key = os.environ.get("OWM_API_KEY")
-    async with aiohttp.ClientSession() as session:
-        payload = {"q": city}
-        if api_key is not None:
-            payload["appid"] = api_key
-
-        async with session.get("http://api.openweathermap.org/geo/1.0/direct", params=payload) as response:
-            response_data = await response.json()
-            lat, lon = response_data[0]["lat"], response_data[0]["lon"]
-
-        payload = {"lat": lat, "lon": lon, "units": "metric"}
-        if api_key is not None:
-            payload["appid"] = api_key
-
-        async with session.get("https://api.openweathermap.org/data/2.5/weather", params=payload) as response:
-            weather_data = await response.json()
-            temp = weather_data["main"]["temp"]
-            logger.info(f"Рассчитана температуры для города {city}: {temp} градусов")
-            return temp
+            return self.day_records(key)
@@ -0,0 +1,79 @@
+import aiohttp
+from logger import logger
+from metrics import timed
+from names import normalize_name
+from cache import KnowledgeCache, SingleFlight
+
+GEOCODING_URL = "http://api.openweathermap.org/geo/1.0/direct"
+WEATHER_URL = "https://api.openweathermap.org/data/2.5/weather"
+
+
+class WeatherClient(object):
+    """Температура по городу через OpenWeatherMap с общей сессией и кэшами.
+
+    Координаты городов не меняются и хранятся на диске, температура кэшируется на temp_ttl секунд.
+    """
+
+    def __init__(self, api_key, store=None, temp_ttl=1800, timeout=5, max_connections=20, max_cities=10000):
+        self.api_key = api_key
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_connections = max_connections
+        self.session = None
+        self.coordinates = KnowledgeCache("geo", max_cities, None, store)
+        self.temperatures = KnowledgeCache("temperature", max_cities, temp_ttl)
+        self.flight = SingleFlight("weather")
+        # Функции (город, температура), вызываемые после каждого обновления температуры города
+        self.listeners = []
+
+    async def start(self):
+        self.coordinates.load()
+        self._get_session()
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.max_connections, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _request(self, url, payload):
+        if self.api_key is not None:
+            payload["appid"] = self.api_key
+        async with self._get_session().get(url, params=payload) as response:
+            response.raise_for_status()
+            return await response.json()
+
+    async def _fetch_temp(self, city):
+        coordinates = self.coordinates.get(city)
+        if coordinates is None:
+            response_data = await self._request(GEOCODING_URL, {"q": city})
+            coordinates = [response_data[0]["lat"], response_data[0]["lon"]]
+            self.coordinates.set(city, coordinates)
+
+        lat, lon = coordinates
+        weather_data = await self._request(WEATHER_URL, {"lat": lat, "lon": lon, "units": "metric"})
+        temp = weather_data["main"]["temp"]
+        self.temperatures.set(city, temp)
+        logger.info("Рассчитана температуры для города %s: %s градусов", city, temp)
+        for listener in self.listeners:
+            listener(city, temp)
+        return temp
+
+    @timed("get_temp")
+    async def get_temp(self, city):
+        logger.info("Расчет температуры для города: %s", city)
+        city = normalize_name(city)
+        temp = self.temperatures.get(city)
+        if temp is not None:
+            return temp
+        # Одновременные запросы по одному городу ждут общий ответ
+        return await self.flight.do(city, lambda: self._fetch_temp(city))
+
+    async def refresh_temp(self, city):
+        """Запросить температуру заново, не дожидаясь истечения срока записи в кэше."""
+        city = normalize_name(city)
+        return await self.flight.do(city, lambda: self._fetch_temp(city))
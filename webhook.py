@@ -0,0 +1,95 @@
+import signal
+import asyncio
+from aiohttp import web
+from logger import logger
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """Обработчик вебхука с ограничением числа одновременно обрабатываемых обновлений.
+
+    Telegram сразу получает ответ, а обновление обрабатывается в фоне. Если в работе уже
+    max_pending обновлений, новые отклоняются с 503 и Telegram повторит их позже.
+    При остановке новые обновления не принимаются, а начатые дорабатываются до drain_timeout секунд.
+    """
+
+    def __init__(self, dispatcher, bot, max_concurrency=64, max_pending=1000, drain_timeout=30, **kwargs):
+        super().__init__(dispatcher, bot, handle_in_background=True, **kwargs)
+        self.max_pending = max_pending
+        self.drain_timeout = drain_timeout
+        self.accepting = True
+        self.rejected = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @property
+    def pending(self):
+        return len(self._background_feed_update_tasks)
+
+    def stats(self):
+        return {"pending": self.pending, "rejected": self.rejected}
+
+    async def _background_feed_update(self, bot, update):
+        async with self._semaphore:
+            await super()._background_feed_update(bot, update)
+
+    async def handle(self, request):
+        if not self.accepting or self.pending >= self.max_pending:
+            self.rejected += 1
+            return web.Response(status=503, text="Service Unavailable")
+        return await super().handle(request)
+
+    async def close(self):
+        self.accepting = False
+        tasks = set(self._background_feed_update_tasks)
+        if tasks:
+            logger.info("Ожидание завершения %s обновлений перед остановкой", len(tasks))
+            done, not_done = await asyncio.wait(tasks, timeout=self.drain_timeout)
+            if not_done:
+                logger.warning("Не дождались %s обновлений за %s с", len(not_done), self.drain_timeout)
+        await super().close()
+
+
+def create_app(dispatcher, bot, base_url, path, secret=None, max_concurrency=64, max_pending=1000, drain_timeout=30):
+    app = web.Application()
+    handler = LimitedRequestHandler(
+        dispatcher, bot, max_concurrency, max_pending, drain_timeout, secret_token=secret
+    )
+    # Обработчик регистрируется раньше диспетчера: при остановке сначала дорабатываются
+    # начатые обновления и только потом выполняются shutdown-обработчики бота
+    handler.register(app, path=path)
+    setup_application(app, dispatcher, bot=bot)
+
+    async def set_webhook(app):
+        await bot.set_webhook(
+            f"{base_url}{path}",
+            secret_token=secret,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+        )
+        logger.info("Вебхук установлен: %s%s", base_url, path)
+
+    if base_url:
+        app.on_startup.append(set_webhook)
+    app["webhook_handler"] = handler
+    return app
+
+
+async def serve(app, host, port):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info("Сервер вебхука запущен на %s:%s", host, port)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: остановка по Ctrl+C через отмену asyncio.run
+            pass
+
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()